@@ -1,8 +1,30 @@
 """Possible leaky bucket implementation for per flow and per item scenarios."""
 
 
+import math
 import time
+import heapq
+import hashlib
+import itertools
 import logging
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+# share of `xmit_unit` possible xmit may exceed burst by, `burst` is multiple of `xmit_unit`,
+# so float sums of `xmit_unit` have to reach it despite rounding
+XMIT_TOLERANCE = 1e-9
 
 
 def lbucket_alg(pos_xmit, prev_time, curr_time, xmit_unit, burst):
@@ -29,22 +51,122 @@ def lbucket_alg(pos_xmit, prev_time, curr_time, xmit_unit, burst):
     if delta_pos_xmit <= 0:
         delta_pos_xmit = 0
 
-    elif delta_pos_xmit > burst:
+    elif delta_pos_xmit > burst + xmit_unit * XMIT_TOLERANCE:
         return pos_xmit, prev_time
 
     return delta_pos_xmit + xmit_unit, curr_time
 
 
+def lbucket_batch_alg(pos_xmit, prev_time, curr_time, xmit_unit, burst, count):
+    """Leaky bucket algorithm for batch of requests arriving at the same time.
+
+    Args:
+        pos_xmit (int): Possible xmit variable
+        prev_time (int): Last time request arriving
+        curr_time (int): Current time of batch arriving
+        xmit_unit (int): Time for xmit 1 item
+        burst (int): Additional burts for smoothing xmits
+        count (int): Number of requests in batch
+
+    Returns:
+        tuple: from number of admitted requests (the first ones of batch), new pos_xmit and time.
+            The result is the same as of `lbucket_alg()` applied to each request of batch in order.
+    """
+
+    delta_pos_xmit = max(pos_xmit - (curr_time - prev_time), 0)
+
+    if delta_pos_xmit > burst + xmit_unit * XMIT_TOLERANCE or not count:
+        return 0, pos_xmit, prev_time
+
+    # each admitted request adds `xmit_unit` while `delta_pos_xmit` does not exceed `burst`
+    admitted = min(count, int(math.floor((burst - delta_pos_xmit) / xmit_unit + XMIT_TOLERANCE)) + 1)
+
+    return admitted, delta_pos_xmit + admitted * xmit_unit, curr_time
+
+
+def lbucket_chain_alg(req_infos, curr_time, offset, bursts, lbucket=lbucket_alg):
+    """Leaky bucket algorithm for chain of buckets, e.g. item, tenant and global ones.
+
+    Args:
+        req_infos (list(ReqInfo)): Request infos of buckets
+        curr_time (int): Current time request arriving
+        offset (int): Offset serves to purpose of changing time interval rate
+        bursts (list(int)): Additional burts of buckets in number of xmits
+        lbucket (function): Leaky bucket algorithm. Default is `lbucket_alg()`
+
+    Returns:
+        bool: True if request can be xmited, then all request infos are updated,
+            otherwise False and request infos are not changed
+    """
+
+    updates = []
+
+    for req_info, burst in zip(req_infos, bursts):
+        pos_xmit, prev_time = req_info.pos_xmit, req_info.timestamp
+        # time for xmit 1 item
+        xmit_unit = offset / req_info.max_xmit
+
+        new_pos_xmit, new_time = lbucket(pos_xmit, prev_time, curr_time, xmit_unit, xmit_unit * burst)
+
+        # not admitted request does not change state, admitted one changes time or increases pos_xmit
+        if new_time == prev_time and new_pos_xmit == pos_xmit:
+            return False
+
+        updates.append((req_info, new_pos_xmit, new_time))
+
+    for req_info, pos_xmit, prev_time in updates:
+        req_info.pos_xmit, req_info.timestamp = pos_xmit, prev_time
+
+    return True
+
+
+def reserve_xmit(pos_xmit, prev_time, curr_time, xmit_unit, burst, max_delay=0, lbucket=lbucket_alg):
+    """Reserving the earliest time request can be xmited.
+
+    Args:
+        pos_xmit (int): Possible xmit variable
+        prev_time (int): Last time request xmit
+        curr_time (int): Current time request arriving
+        xmit_unit (int): Time for xmit 1 item
+        burst (int): Additional burts for smoothing xmits
+        max_delay (int or None): Max delay of xmit, request is not admitted if it has to be delayed longer,
+            None means any delay. Default is 0 (xmit now or never).
+        lbucket (function): Leaky bucket algorithm. Default is `lbucket_alg()`
+
+    Returns:
+        tuple: from new pos_xmit, time and delay of xmit. If request can not be xmited in `max_delay`,
+            `pos_xmit`, `prev_time` and None are returned
+
+    Reserved time may be later than `prev_time` of next requests, so they are delayed after this one.
+    """
+
+    delay = max(int(math.ceil(pos_xmit - (curr_time - prev_time) - burst - xmit_unit * XMIT_TOLERANCE)), 0)
+
+    if max_delay is not None and delay > max_delay:
+        return pos_xmit, prev_time, None
+
+    new_pos_xmit, new_prev_time = lbucket(pos_xmit, prev_time, curr_time + delay, xmit_unit, burst)
+
+    # request is not admitted by given algorithm
+    if new_prev_time != curr_time + delay:
+        return pos_xmit, prev_time, None
+
+    return new_pos_xmit, new_prev_time, delay
+
+
 class Halt(object):
     """Halt helper class provides simple managed bool obj.
 
     One serves `*_lbucket()` functions as their halt obj with managed state,
     so that if `obj.set()` is performed this allows to stop these functions execution,
-    due stopping the main `while` cycle.
+    due stopping the main `while` cycle. Given queues are woken up on `obj.set()`,
+    so that functions blocked on empty `WaitDeque` are stopped immediately,
+    and reset on `obj.clear()`, so that restarted functions are blocked again.
     """
 
-    def __init__(self):
+    def __init__(self, *queues):
         self._flag = False
+        self._queues = queues
 
     def __bool__(self):
         return self._flag
@@ -52,9 +174,211 @@ class Halt(object):
     def set(self):
         self._flag = True
 
+        for queue in self._queues:
+            queue.wake()
+
     def clear(self):
         self._flag = False
 
+        for queue in self._queues:
+            queue.reset()
+
+
+class WaitDeque(deque):
+    """WaitDeque is deque which allows to wait for appended items.
+
+    One serves `*_lbucket()` functions as input queue, so that thread is blocked until request is appended
+    instead of polling empty queue with sleeping. Idle thread does not use CPU and request is handled
+    as soon as appended. All adding methods (`append`, `appendleft`, `extend`, `extendleft`, `insert`, `+=`)
+    wake up waiting thread.
+    """
+
+    def __init__(self, iterable=(), maxlen=None):
+        super(WaitDeque, self).__init__(iterable, maxlen)
+        self._cond = threading.Condition()
+        self._woken = False
+
+    def append(self, item):
+        with self._cond:
+            super(WaitDeque, self).append(item)
+            self._cond.notify()
+
+    def extend(self, items):
+        with self._cond:
+            super(WaitDeque, self).extend(items)
+            self._cond.notify_all()
+
+    def appendleft(self, item):
+        with self._cond:
+            super(WaitDeque, self).appendleft(item)
+            self._cond.notify()
+
+    def extendleft(self, items):
+        with self._cond:
+            super(WaitDeque, self).extendleft(items)
+            self._cond.notify_all()
+
+    def insert(self, index, item):
+        with self._cond:
+            super(WaitDeque, self).insert(index, item)
+            self._cond.notify()
+
+    def __iadd__(self, items):
+        self.extend(items)
+
+        return self
+
+    def wait(self, timeout=None):
+        """Waiting for items.
+
+        Args:
+            timeout (float or None): Max waiting time, None means waiting until item is appended or `wake()`
+
+        Returns:
+            bool: True if queue has items, otherwise False
+        """
+
+        with self._cond:
+            return self._cond.wait_for(lambda: len(self) or self._woken, timeout) and len(self) > 0
+
+    def wake(self):
+        """Waking up all waiting threads, further waits are not blocked."""
+
+        with self._cond:
+            self._woken = True
+            self._cond.notify_all()
+
+    def reset(self):
+        """Undoing `wake()`, further waits are blocked until item is appended."""
+
+        with self._cond:
+            self._woken = False
+
+
+class DelayHeap(object):
+    """DelayHeap is bounded buffer of delayed requests ordered by their eligible time.
+
+    One serves `*_lbucket_shaping()` functions, requests are pushed with their eligible time
+    and popped by releasing thread, which sleeps until the earliest eligible time.
+    One buffer must not be shared by loops which are halted independently,
+    the first halted loop wakes the buffer up and stops releasing threads of all of them.
+    """
+
+    def __init__(self, maxlen=1024):
+        """__init__
+
+        Args:
+            maxlen (int): Max number of delayed requests. Default is 1024.
+        """
+        self.maxlen = maxlen
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._woken = False
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, eligible_time, req):
+        """Adding delayed request.
+
+        Args:
+            eligible_time (int): Time request can be xmited, see `cast_time()`
+            req (req): Request obj
+
+        Returns:
+            bool: True if request was added, False if buffer is full
+        """
+        with self._cond:
+            if len(self._heap) >= self.maxlen:
+                return False
+
+            item = (eligible_time, next(self._seq), req)
+            heapq.heappush(self._heap, item)
+
+            # releasing thread waits for earlier time
+            if self._heap[0] is item:
+                self._cond.notify()
+
+            return True
+
+    def pop_due(self, get_time, offset):
+        """Waiting for eligible requests.
+
+        Args:
+            get_time (function): Function for getting time value, see `cast_time()`
+            offset (int): Offset serves to purpose of changing time interval rate
+
+        Returns:
+            list: Eligible requests in order of their eligible time, empty if buffer is woken up
+        """
+        with self._cond:
+            while not self._woken:
+                curr_time = get_time(time.time(), offset)
+
+                if self._heap and self._heap[0][0] <= curr_time:
+                    reqs = []
+
+                    while self._heap and self._heap[0][0] <= curr_time:
+                        reqs.append(heapq.heappop(self._heap)[2])
+
+                    return reqs
+
+                self._cond.wait((self._heap[0][0] - curr_time) / float(offset) if self._heap else None)
+
+            return []
+
+    def wake(self):
+        """Waking up releasing thread, further waits are not blocked, delayed requests are not released."""
+
+        with self._cond:
+            self._woken = True
+            self._cond.notify_all()
+
+    def reset(self):
+        """Undoing `wake()`, so buffer can be used by next releasing thread."""
+
+        with self._cond:
+            self._woken = False
+
+    def clear(self):
+        """Removing all delayed requests.
+
+        Returns:
+            list: Removed requests in order of their eligible time
+        """
+        with self._cond:
+            reqs = [item[2] for item in sorted(self._heap)]
+            del self._heap[:]
+
+            return reqs
+
+
+def release_delayed(delayed, out_queue, overwrite, offset, get_time, send_req):
+    """Sending delayed requests at their eligible time until `delayed` is woken up.
+
+    Args:
+        delayed (DelayHeap): Delayed requests
+        out_queue (): Output queue, for sending request to execution
+        overwrite (bool): If `out_queue` is full the option allows to rewrite latest item of the queue
+        offset (int): Offset serves to purpose of changing time interval rate
+        get_time (function): Function for getting time value
+        send_req (function): Function for sending request
+
+    Returns:
+        None
+    """
+
+    reqs = delayed.pop_due(get_time, offset)
+
+    while reqs:
+        for req in reqs:
+            # xmit is used anyway, request was delayed for it
+            if not send_req(out_queue, req, overwrite):
+                logging.debug("Delayed request <{}> is dropped".format(req))
+
+        reqs = delayed.pop_due(get_time, offset)
+
 
 def cast_time(time_value, offset):
     """Time value represented as number of ms, us, etc
@@ -93,6 +417,74 @@ def get_req_deque(in_queue):
         logging.debug("Empty input queue <{}>".format(in_queue))
 
 
+def wait_deque(in_queue, wait_time):
+    """Waiting for request in input queue.
+
+    Args:
+        in_queue (collections.deque or WaitDeque): Input queue, for getting requests
+        wait_time (float or None): Max waiting time, None means waiting until request is appended
+            or queue is woken up, it is valid for WaitDeque only
+
+    Returns:
+        None
+
+    WaitDeque blocks thread until request is appended, other queues are polled by sleeping `wait_time`.
+    """
+
+    if isinstance(in_queue, WaitDeque):
+        in_queue.wait(wait_time)
+
+    elif wait_time:
+        time.sleep(wait_time)
+
+
+def get_reqs_deque(in_queue, size):
+    """Getting batch of requests from input queue.
+
+    Args:
+        in_queue (collections.deque): Input queue, for getting requests
+        size (int): Max number of requests
+
+    Returns:
+        list: requests, may be empty
+    """
+
+    reqs = []
+
+    try:
+        # getting requests, each operation is atomic
+        for _ in range(size):
+            reqs.append(in_queue.popleft())
+
+    # another consumer may empty input queue during getting data
+    except IndexError:
+        pass
+
+    return reqs
+
+
+def send_reqs_deque(out_queue, reqs, overwrite):
+    """Sending batch of requests to output queue by one operation.
+
+    Args:
+        out_queue (collections.deque): Output queue, for setting requests for execution
+        reqs (list): Requests
+        overwrite (bool): If `out_queue` is full the option allows to rewrite latest items of the queue
+
+    Returns:
+        int: Number of added requests, they are the first ones of `reqs`
+    """
+
+    # cheking if output queue has enough space for requests
+    if out_queue.maxlen and not overwrite:
+        reqs = reqs[:max(out_queue.maxlen - len(out_queue), 0)]
+
+    # extending by requests, operation is atomic
+    out_queue.extend(reqs)
+
+    return len(reqs)
+
+
 def send_req_deque(out_queue, req, overwrite):
     """Sending request to output queue.
 
@@ -121,7 +513,7 @@ def flow_lbucket(in_queue, out_queue, max_xmit, burst,
                     halt=False, overwrite=False, wait_time=0.01,
                     offset=1000000, lbucket=lbucket_alg,
                     get_time=cast_time, get_req=get_req_deque,
-                    send_req=send_req_deque):
+                    send_req=send_req_deque, wait_req=wait_deque):
     """Per flow leaky bucket.
 
     Args:
@@ -135,11 +527,14 @@ def flow_lbucket(in_queue, out_queue, max_xmit, burst,
         overwrite (bool): If `out_queue` is full the option allows to rewrite latest item of the queue
             on current request, otherwise just ignore the one. Default is False (no rewriting).
         wait_time (float): Waiting timeout for preventing CPU load if `in_queue` is empty. Default is 0.01 (10 ms).
+            WaitDeque is waited until request is appended, but not longer than `wait_time`,
+            None allows to wait without timeout if `halt` wakes `in_queue` up, see `Halt`.
         offset (int): Offset serves to purpose of changing time interval rate. Default is 1000000.
         lbucket (function): Leaky bucket algorithm. Default is `lbucket_alg()`
         get_time (function): Function for getting time value. Default is `cast_time()`
         get_req (function): Function for getting request. Default is `get_req_deque()`
         send_req (function): Function for sending request. Default is `send_req_deque()`
+        wait_req (function): Function for waiting request if `in_queue` is empty. Default is `wait_deque()`
 
     Returns:
         None
@@ -160,9 +555,8 @@ def flow_lbucket(in_queue, out_queue, max_xmit, burst,
 
         # empty queue, just waiting for data
         if not in_queue:
-            # sleep if nothing in input queue, in order to prevent CPU load
-            if wait_time:
-                time.sleep(wait_time)
+            # blocking or sleeping if nothing in input queue, in order to prevent CPU load
+            wait_req(in_queue, wait_time)
             continue
 
         # getting request, operation is atomic
@@ -171,25 +565,91 @@ def flow_lbucket(in_queue, out_queue, max_xmit, burst,
         if req is None:
             continue
 
-        curr_time = get_time(time.time())
+        curr_time = get_time(time.time(), offset)
 
-        pos_xmit, prev_time = lbucket(pos_xmit, prev_time, curr_time, xmit_unit, burst)
+        new_pos_xmit, new_time = lbucket(pos_xmit, prev_time, curr_time, xmit_unit, burst)
 
-        # if no free attempts request just ignored
-        if prev_time != curr_time:
+        # if no free attempts request just ignored, not admitted request does not change state,
+        # time is not enough to check it, previous request may be admitted at the same time
+        if new_time == prev_time and new_pos_xmit == pos_xmit:
             continue
 
+        pos_xmit, prev_time = new_pos_xmit, new_time
+
         # if sending was not successfully performed, decrease attempt
         if not send_req(out_queue, req, overwrite):
             pos_xmit -= xmit_unit
 
 
+def flow_lbucket_batch(in_queue, out_queue, max_xmit, burst,
+                       halt=False, overwrite=False, wait_time=0.01,
+                       offset=1000000, batch=1024, lbucket_batch=lbucket_batch_alg,
+                       get_time=cast_time, get_reqs=get_reqs_deque,
+                       send_reqs=send_reqs_deque, wait_req=wait_deque):
+    """Per flow leaky bucket handling requests by batches.
+
+    Args:
+        in_queue (): Input queue, see `flow_lbucket()`
+        out_queue (): Output queue, see `flow_lbucket()`
+        max_xmit (int): Max number of xmits per sec
+        burst (int): Additional burts for smoothing transmission
+        halt (Halt): Halt allows to interrupt execution and function returns value. Default is False.
+        overwrite (bool): If `out_queue` is full the option allows to rewrite latest items of the queue
+            on current requests, otherwise just ignore them. Default is False (no rewriting).
+        wait_time (float): Waiting timeout if `in_queue` is empty, see `flow_lbucket()`. Default is 0.01 (10 ms).
+        offset (int): Offset serves to purpose of changing time interval rate. Default is 1000000.
+        batch (int): Max number of requests handled at once. Default is 1024.
+        lbucket_batch (function): Leaky bucket algorithm for batch. Default is `lbucket_batch_alg()`
+        get_time (function): Function for getting time value. Default is `cast_time()`
+        get_reqs (function): Function for getting batch of requests. Default is `get_reqs_deque()`
+        send_reqs (function): Function for sending batch of requests. Default is `send_reqs_deque()`
+        wait_req (function): Function for waiting request if `in_queue` is empty. Default is `wait_deque()`
+
+    Returns:
+        None
+
+    The same as `flow_lbucket()`, but time is got once per batch, all requests of batch are considered
+    as arrived at the same time and admitted requests are sent by one operation.
+    """
+
+    prev_time = 0
+    # possible retransmission value
+    pos_xmit = 0
+    # time for xmit 1 item
+    xmit_unit = offset / max_xmit
+    burst = xmit_unit * burst
+
+    while not halt:
+
+        # empty queue, just waiting for data
+        if not in_queue:
+            # blocking or sleeping if nothing in input queue, in order to prevent CPU load
+            wait_req(in_queue, wait_time)
+            continue
+
+        reqs = get_reqs(in_queue, batch)
+
+        curr_time = get_time(time.time(), offset)
+
+        admitted, pos_xmit, prev_time = lbucket_batch(pos_xmit, prev_time, curr_time, xmit_unit, burst, len(reqs))
+
+        # not admitted requests are just ignored
+        if not admitted:
+            continue
+
+        # if sending was not successfully performed, decrease attempts
+        pos_xmit -= xmit_unit * (admitted - send_reqs(out_queue, reqs[:admitted], overwrite))
+
+
 class ReqInfo(object):
     """ReqInfo is representation request information.
 
     This is possible implementation for example purpose.
     """
 
+    # compact record, millions of ones may be stored
+    __slots__ = ("max_xmit", "timestamp", "lock", "pos_xmit")
+
     def __init__(self, max_xmit, timestamp, lock=None):
         """__init__
 
@@ -204,69 +664,586 @@ class ReqInfo(object):
         self.pos_xmit = 0
 
 
-def req_info_extract(data, req):
-    """Getting request info representation.
-
-    Args:
-        data (dict-like obj): Data for requests, contains: maximum of attemps per sec, timestamp, lock
-        req (req): Request obj
+class StripedData(object):
+    """StripedData is dict-like storage of request infos with striped locks.
 
-    Returns:
-        ReqInfo or None: if request item is present in data,
-            then ReqInfo obj contains: maximum of attemps per sec, timestamp, lock,
-            otherwise None
+    Keys are spread among `stripes` shards by hash, each shard has own lock. Many threads handle
+    requests of different keys without contending on one lock, and there is no need in lock per ReqInfo obj.
     """
 
-    # assuming req has `id` attribute
-    # getting request info, operation is atomic
-    try:
-        req_info = data.get(req.id)
+    def __init__(self, stripes=64):
+        """__init__
 
-    # None for unknown for getting data
-    except AttributeError as err:
-        logging.error("Do not know how to handle <{}>".format(req))
-        logging.exception(err)
+        Args:
+            stripes (int): Number of shards and locks. Default is 64.
+        """
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._shards = [{} for _ in range(stripes)]
 
-        return
+    def _stripe(self, key):
+        return hash(key) % len(self._shards)
 
-    # None for unknown
-    if req_info is None:
-        logging.debug("Unknown request <{}>".format(req))
+    def get_lock(self, key):
+        """Getting lock of key shard.
 
-        return
+        Args:
+            key (hashable): Key, e.g. request id
 
-    return req_info
+        Returns:
+            threading.Lock: Lock of shard
+        """
+        return self._locks[self._stripe(key)]
 
+    def get(self, key, default=None):
+        return self._shards[self._stripe(key)].get(key, default)
 
-def per_item_lbucket(in_queue, out_queue, max_xmit, burst,
-                        data, shared=False, global_lock=None,
-                        halt=False, overwrite=False, wait_time=0.01,
-                        offset=1000000, lbucket=lbucket_alg,
-                        get_time=cast_time, get_req_info=req_info_extract,
-                        get_req=get_req_deque, send_req=send_req_deque):
-    """Per item leaky bucket.
+    def setdefault(self, key, default=None):
+        index = self._stripe(key)
 
-    Args:
-        in_queue (): Input queue, for getting requests, might me any obj defined by get_req()/send_req() methods,
-            must have redefined `__bool__()`
-        out_queue (): Output queue, for sending request to execution, might me any obj
-            defined by get_req()/send_req() methods, must have redefined `__bool__()`
-        max_xmit (int): Max number of xmits per sec
-        burst (int): Additional burts for smoothing transmission.
-        data (dict-like obj): Data for requests, contains: max_xmit, timestamp and pos_xmit,
-            see `lbucket` implementation for details
-        shared (bool): Indicator data is shared and lock has to be used. Default is False.
-        global_lock (threading.Lock() or None): Lock is useful if data is shared between threads. Default is None.
-        halt (Halt): Halt allows to interrupt execution and function returns value. Default is False.
-        overwrite (bool): If `out_queue` is full the option allows to rewrite latest item of the queue
-            on current request, otherwise just ignore the one. Default is False (no rewriting).
-        wait_time (float): Waiting timeout for preventing CPU load if `in_queue` is empty. Default is 0.01 (10 ms).
-        offset (int): Offset serves to purpose of changing time interval rate. Default is 1000000.
-        lbucket (function): Leaky bucket algorithm. Default is `lbucket_alg()`
-        get_time (function): Function for getting time value. Default is `cast_time()`
-        get_req_info (function): Function for getting request info. Default is `req_info_extract()`
-        get_req (function): Function for getting request. Default is `get_req_deque()`
-        send_req (function): Function for sending request. Default is `send_req_deque()`
+        with self._locks[index]:
+            return self._shards[index].setdefault(key, default)
+
+    def __getitem__(self, key):
+        return self._shards[self._stripe(key)][key]
+
+    def __setitem__(self, key, value):
+        index = self._stripe(key)
+
+        with self._locks[index]:
+            self._shards[index][key] = value
+
+    def __delitem__(self, key):
+        index = self._stripe(key)
+
+        with self._locks[index]:
+            del self._shards[index][key]
+
+    def __contains__(self, key):
+        return key in self._shards[self._stripe(key)]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def __iter__(self):
+        for shard in self._shards:
+            for key in list(shard):
+                yield key
+
+
+class TTLData(object):
+    """TTLData is dict-like storage of request infos with lazy creation and eviction of idle ones.
+
+    Request info is created on first request of key with default max xmits. Request infos are kept
+    in LRU order, least recently used ones are evicted if their bucket is drained and they are idle for `ttl`.
+    Drained bucket is the same as new one, so eviction does not change limits. If `max_size` is given,
+    least recently used request infos are evicted on overflow even if not drained.
+    Request info may be evicted while other thread handles it, then its update is lost
+    and next request of key gets new drained bucket.
+    """
+
+    def __init__(self, max_xmit, ttl=60, max_size=None, offset=1000000, get_time=cast_time):
+        """__init__
+
+        Args:
+            max_xmit (int): Max number of attemps per sec for new request infos
+            ttl (float): Min idle time of evicted request info in seconds. Default is 60.
+            max_size (int or None): Max number of request infos. Default is None (no limit).
+            offset (int): Offset serves to purpose of changing time interval rate, the same as of
+                `per_item_lbucket()`. Default is 1000000.
+            get_time (function): Function for getting time value. Default is `cast_time()`
+        """
+        self.max_xmit = max_xmit
+        self.ttl = ttl * offset
+        self.max_size = max_size
+        self.offset = offset
+        self.get_time = get_time
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, curr_time):
+        data = self._data
+
+        while data:
+            req_info = next(iter(data.values()))
+            idle = curr_time - req_info.timestamp
+
+            # bucket is drained and idle for ttl
+            if idle < req_info.pos_xmit or idle < self.ttl:
+                break
+
+            data.popitem(last=False)
+
+    def get(self, key, default=None):
+        """Getting request info, one is created if missing.
+
+        Args:
+            key (hashable): Key, e.g. request id
+            default: Not used, request info is always returned
+
+        Returns:
+            ReqInfo: Request info
+        """
+        curr_time = self.get_time(time.time(), self.offset)
+
+        with self._lock:
+            # evicting before getting, so returned request info is not evicted
+            self._evict(curr_time)
+
+            req_info = self._data.get(key)
+
+            if req_info is not None:
+                self._data.move_to_end(key)
+
+                return req_info
+
+            if self.max_size and len(self._data) >= self.max_size:
+                self._data.popitem(last=False)
+
+            # new bucket is drained, so timestamp does not change limit
+            req_info = self._data[key] = ReqInfo(self.max_xmit, curr_time)
+
+            return req_info
+
+    def __setitem__(self, key, req_info):
+        with self._lock:
+            self._data[key] = req_info
+            self._data.move_to_end(key)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+
+class ArrayData(object):
+    """ArrayData is array-backed storage of request infos for batch handling, see `per_item_lbucket_batch()`.
+
+    Max xmits, possible xmits and timestamps are kept in NumPy arrays, keys are mapped to array indexes.
+    Batch of requests is checked by vectorized leaky bucket algorithm.
+    """
+
+    def __init__(self, capacity=1024):
+        """__init__
+
+        Args:
+            capacity (int): Initial size of arrays, they are grown twice on overflow. Default is 1024.
+
+        Raises:
+            ImportError: if NumPy is not installed
+        """
+        if np is None:
+            raise ImportError("NumPy is required for ArrayData")
+
+        self._index = {}
+        self.max_xmit = np.zeros(capacity, dtype=np.float64)
+        self.pos_xmit = np.zeros(capacity, dtype=np.float64)
+        self.timestamp = np.zeros(capacity, dtype=np.int64)
+
+    def add(self, key, max_xmit, timestamp=0):
+        """Adding request info.
+
+        Args:
+            key (hashable): Key, e.g. request id
+            max_xmit (int): Max number of attemps per sec
+            timestamp (int): Last time request arriving. Default is 0.
+        """
+        index = self._index.get(key)
+
+        if index is None:
+            index = self._index[key] = len(self._index)
+
+            if index == len(self.max_xmit):
+                for name in ("max_xmit", "pos_xmit", "timestamp"):
+                    array = getattr(self, name)
+                    setattr(self, name, np.concatenate((array, np.zeros_like(array))))
+
+        self.max_xmit[index], self.pos_xmit[index], self.timestamp[index] = max_xmit, 0, timestamp
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def get_indexes(self, keys):
+        """Getting array indexes of keys.
+
+        Args:
+            keys (iterable): Keys
+
+        Returns:
+            numpy.ndarray: Indexes, -1 for unknown keys
+        """
+        index = self._index
+
+        return np.fromiter((index.get(key, -1) for key in keys), dtype=np.int64)
+
+    def admit(self, indexes, curr_time, offset, burst):
+        """Vectorized leaky bucket algorithm for batch of requests arriving at the same time.
+
+        Args:
+            indexes (numpy.ndarray): Array indexes of requests, see `get_indexes()`, all of them are known
+            curr_time (int): Current time of batch arriving
+            offset (int): Offset serves to purpose of changing time interval rate
+            burst (int): Additional burts for smoothing transmission, in number of xmits
+
+        Returns:
+            numpy.ndarray: Bool mask of admitted requests
+
+        Requests of the same key are checked in order like by `lbucket_batch_alg()`.
+        """
+
+        keys, inverse, counts = np.unique(indexes, return_inverse=True, return_counts=True)
+
+        # order of each request among requests of its key
+        order = np.argsort(inverse, kind="stable")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(indexes)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        xmit_unit = offset / self.max_xmit[keys]
+        key_burst = xmit_unit * burst
+        delta_pos_xmit = np.maximum(self.pos_xmit[keys] - (curr_time - self.timestamp[keys]), 0)
+
+        admitted = np.where(delta_pos_xmit > key_burst + xmit_unit * XMIT_TOLERANCE, 0,
+                            np.minimum(counts, np.floor((key_burst - delta_pos_xmit) / xmit_unit + XMIT_TOLERANCE) + 1))
+        changed = admitted > 0
+
+        self.pos_xmit[keys[changed]] = delta_pos_xmit[changed] + admitted[changed] * xmit_unit[changed]
+        self.timestamp[keys[changed]] = curr_time
+
+        return rank < admitted[inverse]
+
+    def refund(self, indexes, offset):
+        """Decreasing possible xmits for admitted requests which were not sent.
+
+        Args:
+            indexes (numpy.ndarray): Array indexes of requests
+            offset (int): Offset serves to purpose of changing time interval rate
+        """
+        np.subtract.at(self.pos_xmit, indexes, offset / self.max_xmit[indexes])
+
+
+def stable_hash(key):
+    """Hash of key which is the same in all processes, unlike `hash()` of str.
+
+    Args:
+        key (int, str or bytes): Key, e.g. request id
+
+    Returns:
+        int: Non zero 64 bit hash
+    """
+
+    if isinstance(key, int):
+        # multiplication by odd constant is bijection, so different int keys have different hashes
+        key_hash = ((key + 1) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+
+    else:
+        if not isinstance(key, bytes):
+            key = key.encode("utf-8")
+
+        key_hash = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+    # zero marks empty slot
+    return key_hash or 1
+
+
+class SharedReqInfo(object):
+    """SharedReqInfo is request info kept in SharedData, see ReqInfo.
+
+    Attributes are read from and written to shared memory.
+    """
+
+    __slots__ = ("_data", "_slot")
+
+    # lock of data shard is used, see `req_lock_extract()`
+    lock = None
+
+    def __init__(self, data, slot):
+        self._data = data
+        self._slot = slot
+
+    @property
+    def max_xmit(self):
+        return self._data._max_xmit[self._slot]
+
+    @property
+    def pos_xmit(self):
+        return self._data._pos_xmit[self._slot]
+
+    @pos_xmit.setter
+    def pos_xmit(self, value):
+        self._data._pos_xmit[self._slot] = value
+
+    @property
+    def timestamp(self):
+        return self._data._timestamp[self._slot]
+
+    @timestamp.setter
+    def timestamp(self, value):
+        self._data._timestamp[self._slot] = value
+
+
+class SharedData(object):
+    """SharedData is hash table of request infos in shared memory with striped locks.
+
+    Max xmits, possible xmits and timestamps are kept in `multiprocessing.shared_memory` arrays,
+    so `per_item_lbucket()` in many processes enforces one limit per key. Pass obj to worker processes
+    as argument of `multiprocessing.Process`, shared memory and locks are attached in them.
+    Keys are identified by 64 bit `stable_hash()`, table is of fixed capacity with linear probing.
+    """
+
+    def __init__(self, capacity=1 << 16, stripes=64, context=None):
+        """__init__
+
+        Args:
+            capacity (int): Max number of keys, it is rounded up to power of 2. Default is 65536.
+            stripes (int): Number of locks. Default is 64.
+            context (multiprocessing.context.BaseContext or None): Context of worker processes, locks are created
+                by it, e.g. `multiprocessing.get_context("spawn")`. Default is None (default context).
+
+        Raises:
+            ImportError: if there is no `multiprocessing.shared_memory` (Python < 3.8)
+        """
+        if shared_memory is None:
+            raise ImportError("multiprocessing.shared_memory is required for SharedData")
+
+        self.capacity = 1 << max(capacity - 1, 1).bit_length()
+        # keys, max xmits, possible xmits and timestamps, 8 bytes each
+        self._shm = shared_memory.SharedMemory(create=True, size=self.capacity * 32)
+        context = context or multiprocessing
+        self._locks = [context.Lock() for _ in range(stripes)]
+        self._insert_lock = context.Lock()
+        self._attach()
+
+    def __del__(self):
+        # shared memory can not be closed while arrays are used
+        if getattr(self, "_keys", None) is not None:
+            self.close()
+
+    def _attach(self):
+        buf, size = self._shm.buf, self.capacity * 8
+
+        self._keys = buf[:size].cast("Q")
+        self._max_xmit = buf[size:2 * size].cast("d")
+        self._pos_xmit = buf[2 * size:3 * size].cast("d")
+        self._timestamp = buf[3 * size:4 * size].cast("q")
+
+    def __getstate__(self):
+        return {"name": self._shm.name, "capacity": self.capacity,
+                "locks": self._locks, "insert_lock": self._insert_lock}
+
+    def __setstate__(self, state):
+        self.capacity = state["capacity"]
+        self._shm = shared_memory.SharedMemory(name=state["name"])
+        self._locks = state["locks"]
+        self._insert_lock = state["insert_lock"]
+        self._attach()
+
+    def _find(self, key_hash):
+        """Finding slot of key.
+
+        Returns:
+            tuple: from slot and bool, True if key is there, False if slot is empty.
+                Slot is None if table is full
+        """
+        mask = self.capacity - 1
+        slot = key_hash & mask
+
+        for _ in range(self.capacity):
+            slot_key = self._keys[slot]
+
+            if slot_key == key_hash or not slot_key:
+                return slot, bool(slot_key)
+
+            slot = (slot + 1) & mask
+
+        return None, False
+
+    def add(self, key, max_xmit, timestamp=0):
+        """Adding request info, existing one is reset.
+
+        Args:
+            key (int, str or bytes): Key, e.g. request id
+            max_xmit (int): Max number of attemps per sec
+            timestamp (int): Last time request arriving. Default is 0.
+
+        Raises:
+            ValueError: if table is full
+        """
+        key_hash = stable_hash(key)
+
+        with self._insert_lock, self.get_lock(key):
+            slot, _ = self._find(key_hash)
+
+            if slot is None:
+                raise ValueError("SharedData is full, capacity is <{}>".format(self.capacity))
+
+            self._max_xmit[slot], self._pos_xmit[slot], self._timestamp[slot] = max_xmit, 0, timestamp
+            # key is written at last, so record is complete once other processes find it
+            self._keys[slot] = key_hash
+
+    def get(self, key, default=None):
+        slot, found = self._find(stable_hash(key))
+
+        return SharedReqInfo(self, slot) if found else default
+
+    def get_lock(self, key):
+        """Getting lock of key.
+
+        Args:
+            key (int, str or bytes): Key, e.g. request id
+
+        Returns:
+            multiprocessing.Lock: Lock of stripe
+        """
+        return self._locks[stable_hash(key) % len(self._locks)]
+
+    def __contains__(self, key):
+        return self._find(stable_hash(key))[1]
+
+    def __len__(self):
+        return sum(1 for key_hash in self._keys if key_hash)
+
+    def close(self):
+        """Detaching shared memory in current process."""
+
+        for name in ("_keys", "_max_xmit", "_pos_xmit", "_timestamp"):
+            getattr(self, name).release()
+            setattr(self, name, None)
+
+        self._shm.close()
+
+    def unlink(self):
+        """Deleting shared memory, one has to be called once, e.g. by creator after workers are done."""
+
+        self._shm.unlink()
+
+
+def req_info_extract(data, req):
+    """Getting request info representation.
+
+    Args:
+        data (dict-like obj): Data for requests, contains: maximum of attemps per sec, timestamp, lock
+        req (req): Request obj
+
+    Returns:
+        ReqInfo or None: if request item is present in data,
+            then ReqInfo obj contains: maximum of attemps per sec, timestamp, lock,
+            otherwise None
+    """
+
+    # assuming req has `id` attribute
+    # getting request info, operation is atomic
+    try:
+        req_info = data.get(req.id)
+
+    # None for unknown for getting data
+    except AttributeError as err:
+        logging.error("Do not know how to handle <{}>".format(req))
+        logging.exception(err)
+
+        return
+
+    # None for unknown
+    if req_info is None:
+        logging.debug("Unknown request <{}>".format(req))
+
+        return
+
+    return req_info
+
+
+def req_lock_extract(data, req, req_info, global_lock):
+    """Getting lock for request info.
+
+    Args:
+        data (dict-like obj): Data for requests, if one has `get_lock()` (see StripedData), lock of key shard is used
+        req (req): Request obj
+        req_info (ReqInfo): Request info
+        global_lock (threading.Lock or None): Lock is used if there are no individual and shard locks
+
+    Returns:
+        threading.Lock or None: individual lock of request info, lock of data shard or global lock, in this order
+    """
+
+    if req_info.lock is not None:
+        return req_info.lock
+
+    get_lock = getattr(data, "get_lock", None)
+
+    if get_lock is not None:
+        return get_lock(req.id)
+
+    return global_lock
+
+
+def data_level(data, key=lambda req: req.id, get_req_info=req_info_extract):
+    """Level of `hierarchical_lbucket()` getting request info from data.
+
+    Args:
+        data (dict-like obj): Data for requests, e.g. per item or per tenant ones
+        key (function): Function for getting key of request. Default is `req.id`
+        get_req_info (function): Function for getting request info. Default is `req_info_extract()`
+
+    Returns:
+        function: Function of request returns request info or None
+    """
+
+    class KeyReq(object):
+        # request info is got by `id` attribute
+        __slots__ = ("id",)
+
+    def get_level(req):
+        key_req = KeyReq()
+        key_req.id = key(req)
+
+        return get_req_info(data, key_req)
+
+    return get_level
+
+
+def per_item_lbucket(in_queue, out_queue, max_xmit, burst,
+                        data, shared=False, global_lock=None,
+                        halt=False, overwrite=False, wait_time=0.01,
+                        offset=1000000, lbucket=lbucket_alg,
+                        get_time=cast_time, get_req_info=req_info_extract,
+                        get_req=get_req_deque, send_req=send_req_deque,
+                        wait_req=wait_deque, get_req_lock=req_lock_extract):
+    """Per item leaky bucket.
+
+    Args:
+        in_queue (): Input queue, for getting requests, might me any obj defined by get_req()/send_req() methods,
+            must have redefined `__bool__()`
+        out_queue (): Output queue, for sending request to execution, might me any obj
+            defined by get_req()/send_req() methods, must have redefined `__bool__()`
+        max_xmit (int): Max number of xmits per sec
+        burst (int): Additional burts for smoothing transmission.
+        data (dict-like obj): Data for requests, contains: max_xmit, timestamp and pos_xmit,
+            see `lbucket` implementation for details
+        shared (bool): Indicator data is shared and lock has to be used. Default is False.
+        global_lock (threading.Lock() or None): Lock is useful if data is shared between threads. Default is None.
+        halt (Halt): Halt allows to interrupt execution and function returns value. Default is False.
+        overwrite (bool): If `out_queue` is full the option allows to rewrite latest item of the queue
+            on current request, otherwise just ignore the one. Default is False (no rewriting).
+        wait_time (float): Waiting timeout for preventing CPU load if `in_queue` is empty. Default is 0.01 (10 ms).
+            WaitDeque is waited until request is appended, but not longer than `wait_time`,
+            None allows to wait without timeout if `halt` wakes `in_queue` up, see `Halt`.
+        offset (int): Offset serves to purpose of changing time interval rate. Default is 1000000.
+        lbucket (function): Leaky bucket algorithm. Default is `lbucket_alg()`
+        get_time (function): Function for getting time value. Default is `cast_time()`
+        get_req_info (function): Function for getting request info. Default is `req_info_extract()`
+        get_req (function): Function for getting request. Default is `get_req_deque()`
+        send_req (function): Function for sending request. Default is `send_req_deque()`
+        wait_req (function): Function for waiting request if `in_queue` is empty. Default is `wait_deque()`
+        get_req_lock (function): Function for getting lock of request info. Default is `req_lock_extract()`
 
     Returns:
         dict-like obj or None: `dict-like obj` is returned if no shared data is used,
@@ -275,16 +1252,16 @@ def per_item_lbucket(in_queue, out_queue, max_xmit, burst,
     A function handles requests from given `in_queue` checks if there is possibility to transmit request
     per certain time. If yes, it sends rqeuest into `out_queue`, otherwise request is ignored.
     The function is able to work on local and on shared data. An individual lock provided ReqInfo obj is used
-    for performing safe data operations. If no individual lock provided then global lock is used.
+    for performing safe data operations. If no individual lock provided then lock of data shard is used
+    for StripedData, otherwise global lock is used.
     """
 
     while not halt:
 
         # empty queue, just waiting for data
         if not in_queue:
-            # sleep if nothing in input queue, in order to prevent CPU load
-            if wait_time:
-                time.sleep(wait_time)
+            # blocking or sleeping if nothing in input queue, in order to prevent CPU load
+            wait_req(in_queue, wait_time)
             continue
 
         # getting request, operation is atomic
@@ -294,41 +1271,439 @@ def per_item_lbucket(in_queue, out_queue, max_xmit, burst,
             continue
 
         # getting request info, operation is atomic
-        req_info = req_info_extract(data, req)
+        req_info = get_req_info(data, req)
 
         # dropping unknown request
         if req_info is None:
             continue
 
         # on shared data lock has to be performed
+        lock = get_req_lock(data, req, req_info, global_lock) if shared else None
+
+        if shared and lock is None:
+            logging.error("Can not get lock neither via request info obj <{}> nor via data <{}> "
+                          "nor via global lock <{}>".format(req_info, data, global_lock))
+
         # getting lock for checking if request info can be handled
-        if shared and getattr(req_info.lock or global_lock, "aquire", lambda: False)() is False:
-            logging.error("Can not aquire lock neither via request info obj <{}> nor via global lock <{}>".format(req_info, global_lock))
+        if lock is not None:
+            lock.acquire()
 
-        # set detail for each item individually
-        curr_time = get_time(time.time())
-        # time for xmit 1 item
-        xmit_unit = offset / req_info.max_xmit
-        burst = xmit_unit * burst
+        try:
+            # set detail for each item individually
+            curr_time = get_time(time.time(), offset)
+            # time for xmit 1 item
+            xmit_unit = offset / req_info.max_xmit
+
+            pos_xmit, prev_time = lbucket(req_info.pos_xmit, req_info.timestamp, curr_time, xmit_unit,
+                                          xmit_unit * burst)
+
+            # if no free attempts request just ignored, not admitted request does not change state
+            if prev_time == req_info.timestamp and pos_xmit == req_info.pos_xmit:
+                continue
+
+            # if sending was not successfully performed, decrease attempt
+            if not send_req(out_queue, req, overwrite):
+                pos_xmit -= xmit_unit
+
+            # updating request info details
+            req_info.pos_xmit, req_info.timestamp = pos_xmit, prev_time
+
+        # releasing lock after end of unsafe operation, including dropped requests
+        finally:
+            if lock is not None:
+                lock.release()
+
+    # returning current data, might be useful for syncronization purpose
+    if not shared:
+        return data
+
+
+def per_item_lbucket_batch(in_queue, out_queue, data, burst,
+                           shared=False, global_lock=None,
+                           halt=False, overwrite=False, wait_time=0.01,
+                           offset=1000000, batch=1024,
+                           get_time=cast_time, get_reqs=get_reqs_deque,
+                           send_reqs=send_reqs_deque, wait_req=wait_deque):
+    """Per item leaky bucket handling requests by batches.
+
+    Args:
+        in_queue (): Input queue, see `per_item_lbucket()`
+        out_queue (): Output queue, see `per_item_lbucket()`
+        data (ArrayData): Data for requests, requests of unknown keys are dropped
+        burst (int): Additional burts for smoothing transmission.
+        shared (bool): Indicator data is shared and lock has to be used. Default is False.
+        global_lock (threading.Lock() or None): Lock of data for whole batch if data is shared. Default is None.
+        halt (Halt): Halt allows to interrupt execution and function returns value. Default is False.
+        overwrite (bool): If `out_queue` is full the option allows to rewrite latest items of the queue
+            on current requests, otherwise just ignore them. Default is False (no rewriting).
+        wait_time (float): Waiting timeout if `in_queue` is empty, see `per_item_lbucket()`. Default is 0.01 (10 ms).
+        offset (int): Offset serves to purpose of changing time interval rate. Default is 1000000.
+        batch (int): Max number of requests handled at once. Default is 1024.
+        get_time (function): Function for getting time value. Default is `cast_time()`
+        get_reqs (function): Function for getting batch of requests. Default is `get_reqs_deque()`
+        send_reqs (function): Function for sending batch of requests. Default is `send_reqs_deque()`
+        wait_req (function): Function for waiting request if `in_queue` is empty. Default is `wait_deque()`
 
-        pos_xmit, prev_time = lbucket(req_info.pos_xmit, req_info.timestamp, curr_time, xmit_unit, burst)
+    Returns:
+        ArrayData or None: `data` is returned if no shared data is used, otherwise `None`.
+
+    The same as `per_item_lbucket()`, but time is got once per batch, all requests of batch are considered
+    as arrived at the same time, they are checked by vectorized algorithm, see `ArrayData.admit()`,
+    and admitted requests are sent by one operation.
+    """
 
-        # if no free attempts request just ignored
-        if prev_time != curr_time:
+    while not halt:
+
+        # empty queue, just waiting for data
+        if not in_queue:
+            # blocking or sleeping if nothing in input queue, in order to prevent CPU load
+            wait_req(in_queue, wait_time)
             continue
 
-        # if sending was not successfully performed, decrease attempt
-        if not send_req(out_queue, req, overwrite):
-            pos_xmit -= xmit_unit
+        reqs = get_reqs(in_queue, batch)
 
-        # updating request info details
-        req_info.pos_xmit, req_info.timestamp = pos_xmit, prev_time
+        # assuming req has `id` attribute, dropping unknown requests
+        indexes = data.get_indexes(req.id for req in reqs)
+        known = np.flatnonzero(indexes >= 0)
 
-        # on shared data lock has to be performed
-        # releasing lock after end of unsfe uperation
-        if shared and getattr(req_info.lock or global_lock, "release", lambda: False)()is False:
-            logging.error("Can not release lock neither via request info obj <{}> nor via global lock <{}>".format(req_info, global_lock))
+        if not len(known):
+            continue
+
+        # on shared data lock has to be performed for whole batch
+        if shared and global_lock is not None:
+            global_lock.acquire()
+
+        try:
+            curr_time = get_time(time.time(), offset)
+
+            admitted = known[data.admit(indexes[known], curr_time, offset, burst)]
+
+            sent = send_reqs(out_queue, [reqs[i] for i in admitted], overwrite)
+
+            # if sending was not successfully performed, decrease attempts
+            if sent < len(admitted):
+                data.refund(indexes[admitted[sent:]], offset)
+
+        # releasing lock after end of unsafe operation
+        finally:
+            if shared and global_lock is not None:
+                global_lock.release()
 
     # returning current data, might be useful for syncronization purpose
     if not shared:
         return data
+
+
+def flow_lbucket_shaping(in_queue, out_queue, max_xmit, burst,
+                         halt=False, overwrite=False, wait_time=0.01,
+                         offset=1000000, max_delay=None, delayed=None,
+                         lbucket=lbucket_alg, get_time=cast_time,
+                         get_req=get_req_deque, send_req=send_req_deque,
+                         wait_req=wait_deque):
+    """Per flow leaky bucket shaping traffic, requests are delayed instead of ignoring.
+
+    Args:
+        in_queue (): Input queue, see `flow_lbucket()`
+        out_queue (): Output queue, see `flow_lbucket()`
+        max_xmit (int): Max number of xmits per sec
+        burst (int): Additional burts for smoothing transmission
+        halt (Halt): Halt allows to interrupt execution and function returns value. Default is False.
+        overwrite (bool): If `out_queue` is full the option allows to rewrite latest item of the queue
+            on current request, otherwise just ignore the one. Default is False (no rewriting).
+        wait_time (float): Waiting timeout if `in_queue` is empty, see `flow_lbucket()`. Default is 0.01 (10 ms).
+        offset (int): Offset serves to purpose of changing time interval rate. Default is 1000000.
+        max_delay (float or None): Max delay of request in seconds, requests to be delayed longer are ignored.
+            Default is None (any delay).
+        delayed (DelayHeap or None): Buffer of delayed requests, if it is full requests are ignored,
+            see `DelayHeap` about sharing. Default is None (DelayHeap of 1024 requests).
+        lbucket (function): Leaky bucket algorithm. Default is `lbucket_alg()`
+        get_time (function): Function for getting time value. Default is `cast_time()`
+        get_req (function): Function for getting request. Default is `get_req_deque()`
+        send_req (function): Function for sending request. Default is `send_req_deque()`
+        wait_req (function): Function for waiting request if `in_queue` is empty. Default is `wait_deque()`
+
+    Returns:
+        None
+
+    Conforming request is sent at once, otherwise the earliest time it can be xmited is reserved
+    and request is sent at this time by releasing thread, see `DelayHeap`. Requests still delayed
+    on halt are not sent, they are released by the next run with the same `delayed` buffer,
+    or dropped if the buffer is not given.
+    """
+
+    prev_time = 0
+    # possible retransmission value
+    pos_xmit = 0
+    # time for xmit 1 item
+    xmit_unit = offset / max_xmit
+    burst = xmit_unit * burst
+    max_delay = None if max_delay is None else max_delay * offset
+
+    # own buffer is not used by next run
+    own_delayed = delayed is None
+    delayed = DelayHeap() if own_delayed else delayed
+    # buffer may be woken up by previous run
+    delayed.reset()
+    releaser = threading.Thread(target=release_delayed,
+                                args=(delayed, out_queue, overwrite, offset, get_time, send_req))
+    releaser.daemon = True
+    releaser.start()
+
+    try:
+        while not halt:
+
+            # empty queue, just waiting for data
+            if not in_queue:
+                # blocking or sleeping if nothing in input queue, in order to prevent CPU load
+                wait_req(in_queue, wait_time)
+                continue
+
+            # getting request, operation is atomic
+            req = get_req(in_queue)
+            # if no req, just continue
+            if req is None:
+                continue
+
+            curr_time = get_time(time.time(), offset)
+
+            pos_xmit, prev_time, delay = reserve_xmit(pos_xmit, prev_time, curr_time, xmit_unit, burst,
+                                                      max_delay, lbucket)
+
+            # request can not be xmited in max delay, just ignored
+            if delay is None:
+                continue
+
+            # if sending or delaying was not successfully performed, decrease attempt
+            if not (delayed.push(curr_time + delay, req) if delay else send_req(out_queue, req, overwrite)):
+                pos_xmit -= xmit_unit
+
+    # stopping releasing thread
+    finally:
+        delayed.wake()
+        releaser.join()
+
+        if own_delayed and len(delayed):
+            logging.info("<{}> delayed requests are dropped on halt".format(len(delayed.clear())))
+
+
+def per_item_lbucket_shaping(in_queue, out_queue, max_xmit, burst,
+                             data, shared=False, global_lock=None,
+                             halt=False, overwrite=False, wait_time=0.01,
+                             offset=1000000, max_delay=None, delayed=None,
+                             lbucket=lbucket_alg, get_time=cast_time,
+                             get_req_info=req_info_extract, get_req=get_req_deque,
+                             send_req=send_req_deque, wait_req=wait_deque,
+                             get_req_lock=req_lock_extract):
+    """Per item leaky bucket shaping traffic, requests are delayed instead of ignoring.
+
+    Args:
+        in_queue (): Input queue, see `per_item_lbucket()`
+        out_queue (): Output queue, see `per_item_lbucket()`
+        max_xmit (int): Max number of xmits per sec
+        burst (int): Additional burts for smoothing transmission.
+        data (dict-like obj): Data for requests, see `per_item_lbucket()`
+        shared (bool): Indicator data is shared and lock has to be used. Default is False.
+        global_lock (threading.Lock() or None): Lock is useful if data is shared between threads. Default is None.
+        halt (Halt): Halt allows to interrupt execution and function returns value. Default is False.
+        overwrite (bool): If `out_queue` is full the option allows to rewrite latest item of the queue
+            on current request, otherwise just ignore the one. Default is False (no rewriting).
+        wait_time (float): Waiting timeout if `in_queue` is empty, see `per_item_lbucket()`. Default is 0.01 (10 ms).
+        offset (int): Offset serves to purpose of changing time interval rate. Default is 1000000.
+        max_delay (float or None): Max delay of request in seconds, requests to be delayed longer are ignored.
+            Default is None (any delay).
+        delayed (DelayHeap or None): Buffer of delayed requests of all items, if it is full requests are ignored,
+            see `DelayHeap` about sharing. Default is None (DelayHeap of 1024 requests).
+        lbucket (function): Leaky bucket algorithm. Default is `lbucket_alg()`
+        get_time (function): Function for getting time value. Default is `cast_time()`
+        get_req_info (function): Function for getting request info. Default is `req_info_extract()`
+        get_req (function): Function for getting request. Default is `get_req_deque()`
+        send_req (function): Function for sending request. Default is `send_req_deque()`
+        wait_req (function): Function for waiting request if `in_queue` is empty. Default is `wait_deque()`
+        get_req_lock (function): Function for getting lock of request info. Default is `req_lock_extract()`
+
+    Returns:
+        dict-like obj or None: `dict-like obj` is returned if no shared data is used, otherwise `None`.
+
+    The same as `flow_lbucket_shaping()` for each item, see `per_item_lbucket()` for locking details.
+    Requests dropped on halt return their reserved xmits to request infos, data outlives the function.
+    """
+
+    max_delay = None if max_delay is None else max_delay * offset
+
+    # own buffer is not used by next run
+    own_delayed = delayed is None
+    delayed = DelayHeap() if own_delayed else delayed
+    # buffer may be woken up by previous run
+    delayed.reset()
+    releaser = threading.Thread(target=release_delayed,
+                                args=(delayed, out_queue, overwrite, offset, get_time, send_req))
+    releaser.daemon = True
+    releaser.start()
+
+    try:
+        while not halt:
+
+            # empty queue, just waiting for data
+            if not in_queue:
+                # blocking or sleeping if nothing in input queue, in order to prevent CPU load
+                wait_req(in_queue, wait_time)
+                continue
+
+            # getting request, operation is atomic
+            req = get_req(in_queue)
+            # if no req, just continue
+            if req is None:
+                continue
+
+            # getting request info, operation is atomic
+            req_info = get_req_info(data, req)
+
+            # dropping unknown request
+            if req_info is None:
+                continue
+
+            # on shared data lock has to be performed
+            lock = get_req_lock(data, req, req_info, global_lock) if shared else None
+
+            if shared and lock is None:
+                logging.error("Can not get lock neither via request info obj <{}> nor via data <{}> "
+                              "nor via global lock <{}>".format(req_info, data, global_lock))
+
+            if lock is not None:
+                lock.acquire()
+
+            try:
+                curr_time = get_time(time.time(), offset)
+                # time for xmit 1 item
+                xmit_unit = offset / req_info.max_xmit
+
+                pos_xmit, prev_time, delay = reserve_xmit(req_info.pos_xmit, req_info.timestamp, curr_time,
+                                                          xmit_unit, xmit_unit * burst, max_delay, lbucket)
+
+                # request can not be xmited in max delay, just ignored
+                if delay is None:
+                    continue
+
+                # if sending or delaying was not successfully performed, decrease attempt
+                if not (delayed.push(curr_time + delay, req) if delay else send_req(out_queue, req, overwrite)):
+                    pos_xmit -= xmit_unit
+
+                # updating request info details
+                req_info.pos_xmit, req_info.timestamp = pos_xmit, prev_time
+
+            # releasing lock after end of unsafe operation, including dropped requests
+            finally:
+                if lock is not None:
+                    lock.release()
+
+    # stopping releasing thread
+    finally:
+        delayed.wake()
+        releaser.join()
+
+        if own_delayed and len(delayed):
+            reqs = delayed.clear()
+
+            logging.info("<{}> delayed requests are dropped on halt".format(len(reqs)))
+
+            # reserved xmits of dropped requests are returned
+            for req in reqs:
+                req_info = get_req_info(data, req)
+
+                if req_info is None:
+                    continue
+
+                lock = get_req_lock(data, req, req_info, global_lock) if shared else None
+
+                if lock is not None:
+                    lock.acquire()
+
+                try:
+                    req_info.pos_xmit -= offset / req_info.max_xmit
+
+                finally:
+                    if lock is not None:
+                        lock.release()
+
+    # returning current data, might be useful for syncronization purpose
+    if not shared:
+        return data
+
+
+def hierarchical_lbucket(in_queue, out_queue, levels, burst,
+                         shared=False, global_lock=None,
+                         halt=False, overwrite=False, wait_time=0.01,
+                         offset=1000000, lbucket=lbucket_alg,
+                         get_time=cast_time, get_req=get_req_deque,
+                         send_req=send_req_deque, wait_req=wait_deque):
+    """Hierarchical leaky bucket, request is checked by chain of buckets at once.
+
+    Args:
+        in_queue (): Input queue, see `per_item_lbucket()`
+        out_queue (): Output queue, see `per_item_lbucket()`
+        levels (list(function)): Functions of request returning request info of each level, e.g. item,
+            tenant and global ones, see `data_level()`. If any of them returns None, request is dropped
+        burst (int or list(int)): Additional burts for smoothing transmission, common or per level
+        shared (bool): Indicator data is shared and lock has to be used. Default is False.
+        global_lock (threading.Lock() or None): Lock of all levels if data is shared. Default is None.
+        halt (Halt): Halt allows to interrupt execution and function returns value. Default is False.
+        overwrite (bool): If `out_queue` is full the option allows to rewrite latest item of the queue
+            on current request, otherwise just ignore the one. Default is False (no rewriting).
+        wait_time (float): Waiting timeout if `in_queue` is empty, see `per_item_lbucket()`. Default is 0.01 (10 ms).
+        offset (int): Offset serves to purpose of changing time interval rate. Default is 1000000.
+        lbucket (function): Leaky bucket algorithm. Default is `lbucket_alg()`
+        get_time (function): Function for getting time value. Default is `cast_time()`
+        get_req (function): Function for getting request. Default is `get_req_deque()`
+        send_req (function): Function for sending request. Default is `send_req_deque()`
+        wait_req (function): Function for waiting request if `in_queue` is empty. Default is `wait_deque()`
+
+    Returns:
+        None
+
+    Request is sent if all levels admit it, then state of all levels is updated, see `lbucket_chain_alg()`.
+    If request is not admitted by any level, state of no level is changed. There are no intermediate queues
+    between levels, unlike chaining of `per_item_lbucket()` and `flow_lbucket()`.
+    """
+
+    bursts = burst if isinstance(burst, (list, tuple)) else [burst] * len(levels)
+
+    while not halt:
+
+        # empty queue, just waiting for data
+        if not in_queue:
+            # blocking or sleeping if nothing in input queue, in order to prevent CPU load
+            wait_req(in_queue, wait_time)
+            continue
+
+        # getting request, operation is atomic
+        req = get_req(in_queue)
+        # if no req, just continue
+        if req is None:
+            continue
+
+        req_infos = [get_level(req) for get_level in levels]
+
+        # dropping request unknown by any level
+        if None in req_infos:
+            continue
+
+        # on shared data lock has to be performed for all levels
+        if shared and global_lock is not None:
+            global_lock.acquire()
+
+        try:
+            curr_time = get_time(time.time(), offset)
+
+            # if no free attempts on any level request just ignored
+            if not lbucket_chain_alg(req_infos, curr_time, offset, bursts, lbucket):
+                continue
+
+            # if sending was not successfully performed, decrease attempts of all levels
+            if not send_req(out_queue, req, overwrite):
+                for req_info in req_infos:
+                    req_info.pos_xmit -= offset / req_info.max_xmit
+
+        # releasing lock after end of unsafe operation
+        finally:
+            if shared and global_lock is not None:
+                global_lock.release()
@@ -0,0 +1,305 @@
+"""Leaky bucket implementation for asyncio, per flow and per item scenarios."""
+
+
+import time
+import asyncio
+import logging
+
+from lbucket import cast_time, lbucket_alg, req_info_extract, reserve_xmit
+
+
+class AsyncLBucket(object):
+    """Leaky bucket for asyncio code.
+
+    Admission is awaited, if request has to be delayed it sleeps on event loop timer.
+    """
+
+    def __init__(self, max_xmit, burst, offset=1000000, lbucket=lbucket_alg, get_time=cast_time):
+        """__init__
+
+        Args:
+            max_xmit (int): Max number of xmits per sec
+            burst (int): Additional burts for smoothing transmission
+            offset (int): Offset serves to purpose of changing time interval rate. Default is 1000000.
+            lbucket (function): Leaky bucket algorithm. Default is `lbucket_alg()`
+            get_time (function): Function for getting time value. Default is `cast_time()`
+        """
+        self.offset = offset
+        self.lbucket = lbucket
+        self.get_time = get_time
+        # time for xmit 1 item
+        self.xmit_unit = offset / max_xmit
+        self.burst = self.xmit_unit * burst
+        # possible retransmission value
+        self.pos_xmit = 0
+        self.prev_time = 0
+
+    def reserve(self, max_delay=0):
+        """Reserving xmit of request.
+
+        Args:
+            max_delay (float or None): Max delay in seconds, None means any delay. Default is 0.
+
+        Returns:
+            float or None: Delay in seconds, None if request is not admitted
+        """
+
+        curr_time = self.get_time(time.time(), self.offset)
+
+        self.pos_xmit, self.prev_time, delay = reserve_xmit(
+            self.pos_xmit, self.prev_time, curr_time, self.xmit_unit, self.burst,
+            None if max_delay is None else max_delay * self.offset, self.lbucket)
+
+        return None if delay is None else delay / float(self.offset)
+
+    def refund(self):
+        """Returning reserved xmit, e.g. if request was not sent."""
+
+        self.pos_xmit -= self.xmit_unit
+
+    def try_admit(self):
+        """Admission without delay.
+
+        Returns:
+            bool: True if request can be xmited now, otherwise False
+        """
+
+        return self.reserve(0) is not None
+
+    async def admit(self, max_delay=None):
+        """Waiting for admission.
+
+        Args:
+            max_delay (float or None): Max delay in seconds, None means any delay. Default is None.
+
+        Returns:
+            bool: True if request can be xmited now, False if it has to be delayed longer than `max_delay`
+        """
+
+        delay = self.reserve(max_delay)
+
+        if delay is None:
+            return False
+
+        if delay:
+            try:
+                await asyncio.sleep(delay)
+
+            # cancelled request does not use reserved xmit
+            except asyncio.CancelledError:
+                self.refund()
+
+                raise
+
+        return True
+
+
+class Timers(object):
+    """Timers of delayed requests.
+
+    Pending timers are cancelled together, so requests are not sent after limiter coroutine is cancelled.
+    """
+
+    def __init__(self, loop):
+        """__init__
+
+        Args:
+            loop (asyncio.AbstractEventLoop): Running event loop
+        """
+        self.loop = loop
+        self._handles = {}
+
+    def __len__(self):
+        return len(self._handles)
+
+    def call_later(self, delay, callback, *args):
+        """Scheduling callback, see `loop.call_later()`.
+
+        Args:
+            delay (float): Delay in seconds
+            callback (function): Function, one is called with `args`
+            args: Arguments of callback
+        """
+
+        handle = None
+
+        def fire():
+            del self._handles[handle]
+
+            callback(*args)
+
+        handle = self.loop.call_later(delay, fire)
+        self._handles[handle] = args
+
+    def cancel(self):
+        """Cancelling pending timers.
+
+        Returns:
+            list(tuple): Arguments of cancelled callbacks
+        """
+
+        for handle in self._handles:
+            handle.cancel()
+
+        cancelled = list(self._handles.values())
+        self._handles.clear()
+
+        return cancelled
+
+
+def send_req_queue(out_queue, req, overwrite):
+    """Sending request to output queue.
+
+    Args:
+        out_queue (asyncio.Queue): Output queue, for setting request for execution
+        req (req): Request obj
+        overwrite (bool): If `out_queue` is full the option allows to rewrite oldest item of the queue
+
+    Returns:
+        bool: True if request was added, otherwise False
+    """
+
+    try:
+        out_queue.put_nowait(req)
+
+    except asyncio.QueueFull:
+        if not overwrite:
+            logging.debug("Overloaded output queue <{}>".format(out_queue))
+
+            return False
+
+        # dropping oldest item like full deque does on append
+        out_queue.get_nowait()
+        out_queue.put_nowait(req)
+
+    return True
+
+
+async def flow_lbucket_async(in_queue, out_queue, max_xmit, burst,
+                             overwrite=False, max_delay=0,
+                             offset=1000000, lbucket=lbucket_alg,
+                             get_time=cast_time, send_req=send_req_queue):
+    """Per flow leaky bucket for asyncio.
+
+    Args:
+        in_queue (asyncio.Queue): Input queue, for getting requests
+        out_queue (asyncio.Queue): Output queue, for sending request to execution
+        max_xmit (int): Max number of xmits per sec
+        burst (int): Additional burts for smoothing transmission
+        overwrite (bool): If `out_queue` is full the option allows to rewrite oldest item of the queue
+            on current request, otherwise just ignore the one. Default is False (no rewriting).
+        max_delay (float or None): Max delay of request in seconds, delayed requests are sent by event loop timer,
+            None means any delay. Default is 0 (requests are sent now or ignored like by `flow_lbucket()`).
+        offset (int): Offset serves to purpose of changing time interval rate. Default is 1000000.
+        lbucket (function): Leaky bucket algorithm. Default is `lbucket_alg()`
+        get_time (function): Function for getting time value. Default is `cast_time()`
+        send_req (function): Function for sending request. Default is `send_req_queue()`
+
+    Returns:
+        None
+
+    Coroutine runs until it is cancelled. Each handled request is marked by `in_queue.task_done()`.
+    Delayed requests are not sent after cancellation.
+    """
+
+    timers = Timers(asyncio.get_running_loop())
+    bucket = AsyncLBucket(max_xmit, burst, offset, lbucket, get_time)
+
+    def send(req):
+        # if sending was not successfully performed, decrease attempt
+        if not send_req(out_queue, req, overwrite):
+            bucket.refund()
+
+    try:
+        while True:
+            req = await in_queue.get()
+
+            delay = bucket.reserve(max_delay)
+
+            # if no free attempts request just ignored
+            if delay is None:
+                pass
+
+            elif delay:
+                timers.call_later(delay, send, req)
+
+            else:
+                send(req)
+
+            in_queue.task_done()
+
+    finally:
+        timers.cancel()
+
+
+async def per_item_lbucket_async(in_queue, out_queue, data, burst,
+                                 overwrite=False, max_delay=0,
+                                 offset=1000000, lbucket=lbucket_alg,
+                                 get_time=cast_time, get_req_info=req_info_extract,
+                                 send_req=send_req_queue):
+    """Per item leaky bucket for asyncio.
+
+    Args:
+        in_queue (asyncio.Queue): Input queue, for getting requests
+        out_queue (asyncio.Queue): Output queue, for sending request to execution
+        data (dict-like obj): Data for requests, contains ReqInfo objs, see `per_item_lbucket()`
+        burst (int): Additional burts for smoothing transmission.
+        overwrite (bool): If `out_queue` is full the option allows to rewrite oldest item of the queue
+            on current request, otherwise just ignore the one. Default is False (no rewriting).
+        max_delay (float or None): Max delay of request in seconds, delayed requests are sent by event loop timer,
+            None means any delay. Default is 0 (requests are sent now or ignored like by `per_item_lbucket()`).
+        offset (int): Offset serves to purpose of changing time interval rate. Default is 1000000.
+        lbucket (function): Leaky bucket algorithm. Default is `lbucket_alg()`
+        get_time (function): Function for getting time value. Default is `cast_time()`
+        get_req_info (function): Function for getting request info. Default is `req_info_extract()`
+        send_req (function): Function for sending request. Default is `send_req_queue()`
+
+    Returns:
+        None
+
+    All items are handled by one coroutine, there are no task or timer per item except delayed requests,
+    so many items are limited in one event loop. Locks of ReqInfo objs are not used, the loop is single thread.
+    Coroutine runs until it is cancelled. Each handled request is marked by `in_queue.task_done()`.
+    Delayed requests are not sent after cancellation, their reserved xmits are returned to request infos.
+    """
+
+    timers = Timers(asyncio.get_running_loop())
+    max_delay = None if max_delay is None else max_delay * offset
+
+    def send(req, req_info, xmit_unit):
+        # if sending was not successfully performed, decrease attempt
+        if not send_req(out_queue, req, overwrite):
+            req_info.pos_xmit -= xmit_unit
+
+    try:
+        while True:
+            req = await in_queue.get()
+
+            req_info = get_req_info(data, req)
+
+            # dropping unknown request
+            if req_info is not None:
+                curr_time = get_time(time.time(), offset)
+                # time for xmit 1 item
+                xmit_unit = offset / req_info.max_xmit
+
+                req_info.pos_xmit, req_info.timestamp, delay = reserve_xmit(
+                    req_info.pos_xmit, req_info.timestamp, curr_time, xmit_unit, xmit_unit * burst, max_delay,
+                    lbucket)
+
+                # if no free attempts request just ignored
+                if delay is None:
+                    pass
+
+                elif delay:
+                    timers.call_later(delay / float(offset), send, req, req_info, xmit_unit)
+
+                else:
+                    send(req, req_info, xmit_unit)
+
+            in_queue.task_done()
+
+    # data outlives coroutine, so xmits of cancelled requests are returned
+    finally:
+        for _, req_info, xmit_unit in timers.cancel():
+            req_info.pos_xmit -= xmit_unit
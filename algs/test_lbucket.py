@@ -0,0 +1,134 @@
+"""Tests of batch leaky bucket algorithms and loops against sequential `lbucket_alg()`."""
+
+
+import random
+import unittest
+from collections import deque
+
+from lbucket import (ArrayData, Halt, ReqInfo, flow_lbucket, lbucket_alg, lbucket_batch_alg, np,
+                     per_item_lbucket)
+
+
+OFFSET = 1000000
+
+
+def sequential(pos_xmit, prev_time, curr_time, xmit_unit, burst, count):
+    """Applying `lbucket_alg()` to each request of batch, returns the same as `lbucket_batch_alg()`."""
+
+    admitted = 0
+
+    for _ in range(count):
+        new_pos_xmit, new_time = lbucket_alg(pos_xmit, prev_time, curr_time, xmit_unit, burst)
+
+        if new_time == prev_time and new_pos_xmit == pos_xmit:
+            break
+
+        pos_xmit, prev_time = new_pos_xmit, new_time
+        admitted += 1
+
+    return admitted, pos_xmit, prev_time
+
+
+def get_events(rnd, max_xmit):
+    """Arriving times and sizes of batches, times are close enough for bucket to be partially drained."""
+
+    curr_time = rnd.randint(1, OFFSET)
+    events = []
+
+    for _ in range(50):
+        curr_time += rnd.randint(0, 3 * OFFSET // max_xmit)
+        events.append((curr_time, rnd.randint(1, 20)))
+
+    return events
+
+
+class LBucketBatchTest(unittest.TestCase):
+
+    def test_drained_bucket(self):
+        for max_xmit in range(1, 200):
+            xmit_unit = OFFSET / max_xmit
+
+            for burst in range(12):
+                expected = sequential(0, 0, OFFSET, xmit_unit, xmit_unit * burst, 100)[0]
+                actual = lbucket_batch_alg(0, 0, OFFSET, xmit_unit, xmit_unit * burst, 100)[0]
+
+                self.assertEqual(actual, expected, "max_xmit {}, burst {}".format(max_xmit, burst))
+                self.assertEqual(actual, burst + 1, "max_xmit {}, burst {}".format(max_xmit, burst))
+
+    def test_batches(self):
+        rnd = random.Random(0)
+
+        for _ in range(200):
+            max_xmit, burst = rnd.randint(1, 1000), rnd.randint(0, 10)
+            xmit_unit = OFFSET / max_xmit
+            seq_state = batch_state = (0, 0)
+
+            for curr_time, count in get_events(rnd, max_xmit):
+                seq_admitted, seq_pos_xmit, seq_time = sequential(
+                    seq_state[0], seq_state[1], curr_time, xmit_unit, xmit_unit * burst, count)
+                batch_admitted, batch_pos_xmit, batch_time = lbucket_batch_alg(
+                    batch_state[0], batch_state[1], curr_time, xmit_unit, xmit_unit * burst, count)
+
+                self.assertEqual(batch_admitted, seq_admitted)
+                self.assertEqual(batch_time, seq_time)
+                self.assertAlmostEqual(batch_pos_xmit, seq_pos_xmit, delta=xmit_unit * 1e-6)
+
+                seq_state, batch_state = (seq_pos_xmit, seq_time), (batch_pos_xmit, batch_time)
+
+    def test_loops_same_time(self):
+        """Requests arriving in the same time unit are admitted like by batch algorithm."""
+
+        for max_xmit, burst in ((10, 0), (3, 7), (3, 10)):
+            xmit_unit = OFFSET / max_xmit
+            expected = lbucket_batch_alg(0, 0, OFFSET, xmit_unit, xmit_unit * burst, 100)[0]
+
+            for loop in ("flow", "per_item"):
+                in_queue, out_queue, halt = deque(range(100)), deque(), Halt()
+
+                def get_req(queue):
+                    req = queue.popleft()
+                    if not queue:
+                        halt.set()
+                    return req
+
+                kwargs = dict(halt=halt, offset=OFFSET, get_time=lambda time_value, offset: OFFSET, get_req=get_req)
+
+                if loop == "flow":
+                    flow_lbucket(in_queue, out_queue, max_xmit, burst, **kwargs)
+                else:
+                    per_item_lbucket(in_queue, out_queue, max_xmit, burst, {0: ReqInfo(max_xmit, 0)},
+                                     get_req_info=lambda data, req: data[0], **kwargs)
+
+                self.assertEqual(len(out_queue), expected, "{} max_xmit {}, burst {}".format(loop, max_xmit, burst))
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_array_data(self):
+        rnd = random.Random(1)
+        max_xmits = dict((key, rnd.randint(1, 200)) for key in range(20))
+        burst = 3
+
+        data = ArrayData(capacity=4)
+        states = {}
+
+        for key, max_xmit in max_xmits.items():
+            data.add(key, max_xmit)
+            states[key] = (0, 0)
+
+        for curr_time, _ in get_events(rnd, 50):
+            reqs = [rnd.choice(list(max_xmits)) for _ in range(rnd.randint(1, 100))]
+            mask = data.admit(data.get_indexes(reqs), curr_time, OFFSET, burst)
+
+            for key in set(reqs):
+                xmit_unit = OFFSET / max_xmits[key]
+                count = reqs.count(key)
+                admitted, pos_xmit, prev_time = sequential(states[key][0], states[key][1], curr_time,
+                                                           xmit_unit, xmit_unit * burst, count)
+                states[key] = (pos_xmit, prev_time)
+
+                # the first requests of key are admitted
+                self.assertEqual([bool(m) for m, r in zip(mask, reqs) if r == key],
+                                 [True] * admitted + [False] * (count - admitted))
+
+
+if __name__ == "__main__":
+    unittest.main()
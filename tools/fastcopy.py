@@ -1,141 +1,1170 @@
 import os
 import sys
+import argparse
+import errno
+import hashlib
+import json
 import logging
 import mmap
 import stat
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import partial, reduce
+from tempfile import NamedTemporaryFile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+# ioctl request for cloning file extents, see `man ioctl_ficlone`
+FICLONE = 0x40049409
+
+# chunk size for copy inside kernel, data is not copied to userspace,
+# so size only limits number of syscalls and time between interruption checks
+KERNEL_CHUNK = 1 << 30
+
+# errors which mean that engine is not supported for given files (fs, kernel, platform),
+# that is no data was copied and another engine can be used
+UNSUPPORTED_ERRNOS = frozenset(
+    getattr(errno, name) for name in ("ENOSYS", "EXDEV", "EOPNOTSUPP", "ENOTSUP", "EINVAL", "ENOTTY", "EBADF")
+    if hasattr(errno, name))
+
+
+# number of ranges per worker of parallel copy, more ranges balance load of workers better
+RANGES_PER_WORKER = 4
+
+
+# files up to this size are copied by read/write, mmap and kernel engines setup costs more than copy itself
+SMALL_FILE_SIZE = 64 * 1024
+
+# small files are copied in batches by one worker task, batch is limited by number of files and total size
+BATCH_FILES = 64
+BATCH_SIZE = 8 * 1024 * 1024
+
+
+# journal of resumable copy is kept next to destination file with this suffix
+JOURNAL_SUFFIX = ".fcjournal"
+
+# digest of journal checkpoints, one is used to verify destination chunks on resume
+JOURNAL_DIGEST = "blake2b" if "blake2b" in hashlib.algorithms_available else "md5"
+
+# destination is synced and pending checkpoints are written to journal after each JOURNAL_SYNC bytes,
+# so journal describes only data on disk and resume does not have to re-read the whole copied part
+JOURNAL_SYNC = 64 * 1024 * 1024
+
+# number of the last checkpoints verified on resume, they may be lost by fs despite sync
+VERIFY_CHECKPOINTS = 2
+
+# minimal interval between progress callback calls, seconds
+PROGRESS_INTERVAL = 1.0
+
+
+# buffer sizes tried by `tune_buffer`, all of them are powers of 2
+TUNE_BUFFERS = tuple(1 << shift for shift in range(16, 25, 2) if 1 << shift >= mmap.PAGESIZE)
+
+# size of source sample copied by `tune_buffer` with each buffer size
+TUNE_SAMPLE = 64 * 1024 * 1024
+
+# tuned buffer sizes by source and destination devices, see `tune_buffer`
+TUNED_BUFFERS = {}
+
+# destination range is dropped from page cache after this number of bytes is written, see `drop_cache`
+DROP_CACHE_LAG = 64 * 1024 * 1024
+
+# alignment of file offsets and lengths for O_DIRECT, it is multiple of logical block size of common devices
+DIRECT_ALIGN = 4096
+
+
+# result of batch copy
+CopyStats = namedtuple("CopyStats", ("files", "size", "seconds"))
+
+# progress of resumable copy: copied and total bytes, bytes per second and estimated seconds left
+Progress = namedtuple("Progress", ("copied", "total", "speed", "eta"))
+
+
+class EngineNotSupported(Exception):
+    """Copy engine can not be used for given files, no data was copied."""
 
 
 def exc_msg(msg, encoding=sys.stdout.encoding):
     """Encode messages for exeptions
 
     Args:
-        msg (unicode): Message
-        encoding (str): Encoding
+        msg (unicode): Message
+        encoding (str): Encoding
+
+    Returns:
+        str: Encoded message
+    """
+    return msg.encode(encoding)
+
+
+def path_validation(path, length):
+    """Validation and normalization of given path
+
+    Args:
+        path (unicode): Path to file
+        length (unicode): Max possible path length
+
+    Returns:
+        str: normalized path
+
+    Raises:
+        ValueError
+    """
+    # For windows long name prefix `\\?\` will be added
+
+    # normilizers for given path
+    normilizers = [
+        os.path.expandvars,
+        os.path.expanduser,
+        os.path.normpath,
+        os.path.normcase]
+
+    # empty path is not allowed
+    if not path:
+        raise ValueError(u"Empty path")
+
+    # support of long name in windows
+    # adding long name `\\?\` prefix
+    if sys.platform.startswith('win') and not path.startswith(u"\\\\?\\"):
+        path = u"\\\\?\\" + path
+
+    # getting normilized path
+    path = reduce(lambda a, f: f(a), normilizers, path)
+
+    # path is too long
+    if len(path) > length:
+        raise ValueError(
+            exc_msg(u"Path <{}> is too long <{}>. Max path length is <{}>".format(path, len(path), length)))
+
+    # path is not regular file
+    if os.path.exists(path) and not stat.S_ISREG(os.stat(path).st_mode):
+        raise ValueError(exc_msg(u"Path <{}> is not a regular file".format(path)))
+
+    return path
+
+
+def get_mmsrc(src):
+    """Source mmap creation
+
+    Args:
+        src (str): Path to file
+
+    Returns:
+        mmap.mmap: mmap obj of source file for current platform
+    """
+
+    # win mmap is different than *nix
+    if sys.platform.startswith('win') or sys.platform.startswith('cygwin'):
+        return mmap.mmap(src.fileno(), 0, None, mmap.ACCESS_READ, 0)
+
+    # *nix mmap
+    mmsrc = mmap.mmap(src.fileno(), 0, mmap.MAP_SHARED, mmap.PROT_READ, 0, 0)
+
+    # more aggressive readahead, pages are freed soon after reading
+    if hasattr(mmsrc, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+        mmsrc.madvise(mmap.MADV_SEQUENTIAL)
+
+    return mmsrc
+
+
+def advise(fd, advice, offset=0, length=0):
+    """Advice to kernel about file access, that is no-op if `os.posix_fadvise` is not available
+
+    Args:
+        fd (int): File descriptor
+        advice (str): Name of advice without prefix, e.g. `SEQUENTIAL`, `DONTNEED`
+        offset (int): Offset of advised range
+        length (int): Length of advised range, 0 means up to the end of file
+
+    Returns:
+        None
+    """
+
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, offset, length, getattr(os, "POSIX_FADV_" + advice))
+
+
+def drop_cache(src_fd, dst_fd, offset, length):
+    """Dropping copied range from page cache, so copy does not evict cache of other processes
+
+    Args:
+        src_fd (int): Source file descriptor
+        dst_fd (int): Destination file descriptor
+        offset (int): Offset of copied range
+        length (int): Length of copied range
+
+    Returns:
+        None
+
+    Destination pages are dirty right after writing, advice starts their writeback only,
+    so range written DROP_CACHE_LAG bytes before is advised again and its written back pages are dropped.
+    Up to DROP_CACHE_LAG bytes of destination stay in page cache.
+    """
+
+    advise(src_fd, "DONTNEED", offset, length)
+    advise(dst_fd, "DONTNEED", offset, length)
+
+    if offset >= DROP_CACHE_LAG:
+        advise(dst_fd, "DONTNEED", offset - DROP_CACHE_LAG, length)
+
+
+def remove_dst(dst_path, rm_on_err):
+    """Deleting destination file after failed copy
+
+    Args:
+        dst_path (str): Path to destination file
+        rm_on_err (bool): If not set, destination file is kept
+
+    Returns:
+        None
+    """
+
+    if rm_on_err and os.path.exists(dst_path):
+        logging.info(u"Removing destination <{}>".format(dst_path))
+
+        os.remove(dst_path)
+
+
+def open_dst(dst_path):
+    """Opening destination file without truncation
+
+    Args:
+        dst_path (str): Path to destination file, one is created if missing
+
+    Returns:
+        file: Unbuffered file opened for reading and writing
+
+    Engines which may raise EngineNotSupported on the first kernel call use it,
+    so existing destination is not lost, engine truncates it after successful copy.
+    """
+
+    return os.fdopen(os.open(dst_path, os.O_RDWR | os.O_CREAT, 0o666), "r+b", 0)
+
+
+@contextmanager
+def copy_guard(dst_path, rm_on_err=True):
+    """Common error handling of copy engines
+
+    Args:
+        dst_path (str): Path to destination file
+        rm_on_err (bool): If set, deleting destination file on error or interruption. Default is True.
+
+    Raises:
+        Exception: excluding KeyboardInterrupt
+
+    Interruption is logged and swallowed, other errors are logged and raised,
+    destination file is deleted in both cases. EngineNotSupported is raised as is,
+    nothing was copied and caller is going to try another engine, destination is deleted
+    only if engine created it, existing one is kept untouched (see `open_dst`).
+    """
+
+    created = not os.path.exists(dst_path)
+
+    try:
+        yield
+
+    except EngineNotSupported:
+        if created and os.path.exists(dst_path):
+            os.remove(dst_path)
+
+        raise
+
+    except KeyboardInterrupt:
+        logging.info(u"Ctrl+C interruption")
+
+        remove_dst(dst_path, rm_on_err)
+
+    except Exception as err:
+        logging.error(u"An error occured during copy file")
+        logging.exception(err)
+
+        remove_dst(dst_path, rm_on_err)
+
+        raise
+
+
+def mmcopy(src_path, dst_path, buffer, rm_on_err=True):
+    """Copy using mmap
+
+    Args:
+        src_path (str): Path to source file
+        src_path (str): Path to destination file
+        buffer (int): Copy buffer size
+        rm_on_err (bool): If set, deleting destination file on error or interruption. Default is True.
+
+    Returns:
+        None
+
+    Raises:
+        Exception: excluding KeyboardInterrupt
+
+    Copied ranges are dropped from page cache, see `drop_cache`.
+    """
+
+    # preserving UnboundLocalError
+    mmsrc = None
+
+    with copy_guard(dst_path, rm_on_err):
+        try:
+            with open(src_path, "rb", 0) as src, open(dst_path, "w+b", 0) as dst:
+
+                advise(src.fileno(), "SEQUENTIAL")
+
+                mmsrc = get_mmsrc(src)
+
+                offset = 0
+                chunk = mmsrc.read(buffer)
+
+                # writing with chunks
+                while chunk:
+
+                    dst.write(chunk)
+
+                    # mapped pages are not dropped from page cache, so they are unmapped at first
+                    if hasattr(mmsrc, "madvise") and hasattr(mmap, "MADV_DONTNEED"):
+                        mmsrc.madvise(mmap.MADV_DONTNEED, offset, len(chunk))
+
+                    drop_cache(src.fileno(), dst.fileno(), offset, len(chunk))
+
+                    offset += len(chunk)
+                    chunk = mmsrc.read(buffer)
+
+        # there are many type of errors can happened and mmap objs have to be closed in all cases
+        finally:
+            getattr(mmsrc, "close", lambda: None)()
+
+
+def rwcopy(src_path, dst_path, buffer, rm_on_err=True):
+    """Copy using plain read/write
+
+    Args:
+        src_path (str): Path to source file
+        src_path (str): Path to destination file
+        buffer (int): Copy buffer size
+        rm_on_err (bool): If set, deleting destination file on error or interruption. Default is True.
+
+    Returns:
+        None
+
+    Raises:
+        Exception: excluding KeyboardInterrupt
+
+    It is the cheapest engine for tiny files, there is no mmap or kernel engine setup.
+    Copied ranges are dropped from page cache, see `drop_cache`.
+    """
+
+    with copy_guard(dst_path, rm_on_err):
+        with open(src_path, "rb", 0) as src, open(dst_path, "wb", 0) as dst:
+
+            advise(src.fileno(), "SEQUENTIAL")
+
+            offset = 0
+            chunk = src.read(buffer)
+
+            while chunk:
+                dst.write(chunk)
+
+                drop_cache(src.fileno(), dst.fileno(), offset, len(chunk))
+
+                offset += len(chunk)
+                chunk = src.read(buffer)
+
+
+def directcopy(src_path, dst_path, buffer, rm_on_err=True):
+    """Copy bypassing page cache (`O_DIRECT`)
+
+    Args:
+        src_path (str): Path to source file
+        src_path (str): Path to destination file
+        buffer (int): Copy buffer size, one is aligned by DIRECT_ALIGN
+        rm_on_err (bool): If set, deleting destination file on error or interruption. Default is True.
+
+    Returns:
+        None
+
+    Raises:
+        EngineNotSupported: if there is no O_DIRECT or fs does not support it (e.g. tmpfs)
+        Exception: excluding KeyboardInterrupt
+
+    Copy does not evict page cache of other processes, but it is slower for small files and buffers.
+    """
+
+    if getattr(os, "O_DIRECT", None) is None:
+        raise EngineNotSupported(u"O_DIRECT is not available")
+
+    # preserving UnboundLocalError
+    src_fd = dst_fd = None
+
+    with copy_guard(dst_path, rm_on_err):
+        try:
+            try:
+                src_fd = os.open(src_path, os.O_RDONLY | os.O_DIRECT)
+                # destination is truncated after copy, existing one is kept if O_DIRECT is not supported
+                dst_fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_DIRECT, 0o666)
+
+            except OSError as err:
+                if err.errno in UNSUPPORTED_ERRNOS:
+                    raise EngineNotSupported(u"O_DIRECT is not supported: {}".format(err))
+
+                raise
+
+            size = os.fstat(src_fd).st_size
+            # anonymous mmap is page aligned, that is required by O_DIRECT
+            chunk = mmap.mmap(-1, buffer)
+            offset = 0
+
+            try:
+                while offset < size:
+                    read = os.readv(src_fd, [chunk])
+
+                    if not read:
+                        raise IOError(exc_msg(u"Source file is truncated at <{}>".format(offset)))
+
+                    # tail is written by whole aligned block and truncated after
+                    length = -(-read // DIRECT_ALIGN) * DIRECT_ALIGN
+
+                    if os.writev(dst_fd, [memoryview(chunk)[:length]]) != length:
+                        raise IOError(exc_msg(u"Short write to destination at <{}>".format(offset)))
+
+                    offset += read
+
+                    # offset is not aligned after short read, that is the end of file
+                    if read < buffer:
+                        break
+
+            finally:
+                chunk.close()
+
+            os.ftruncate(dst_fd, offset)
+
+        # file descriptors have to be closed in all cases
+        finally:
+            for fd in (src_fd, dst_fd):
+                if fd is not None:
+                    os.close(fd)
+
+
+def get_device_key(src_path, dst_path):
+    """Key of source and destination devices for tuned buffers
+
+    Args:
+        src_path (str): Path to source file
+        dst_path (str): Path to destination file, one may not exist
+
+    Returns:
+        str: Device numbers of source and destination, each one identifies mounted fs
+    """
+
+    dst_dir = os.path.dirname(os.path.abspath(dst_path))
+
+    return u"{}-{}".format(os.stat(src_path).st_dev, os.stat(dst_dir).st_dev)
+
+
+def tune_buffer(src_path, dst_path, default=(512 * mmap.PAGESIZE), buffers=TUNE_BUFFERS,
+                sample=TUNE_SAMPLE, cache_path=None):
+    """Choosing the fastest buffer size for source and destination devices
+
+    Args:
+        src_path (str): Path to source file
+        dst_path (str): Path to destination file
+        default (int): Buffer size is returned if source is too small for tuning. Default is 2Mb
+        buffers (tuple(int)): Tried buffer sizes. Default is TUNE_BUFFERS
+        sample (int): Size of source sample copied with each buffer size. Default is TUNE_SAMPLE
+        cache_path (str): If set, tuned buffers are also kept in this JSON file between runs
+
+    Returns:
+        int: Buffer size
+
+    The beginning of source is copied to temporary file next to destination with each buffer size,
+    source pages are dropped from page cache and destination is synced on each try, so devices are measured
+    instead of page cache. Result is cached by devices pair in TUNED_BUFFERS.
+    """
+
+    key = get_device_key(src_path, dst_path)
+
+    if key not in TUNED_BUFFERS and cache_path and os.path.exists(cache_path):
+        with open(cache_path) as cache:
+            TUNED_BUFFERS.update(json.load(cache))
+
+    if key in TUNED_BUFFERS:
+        return TUNED_BUFFERS[key]
+
+    sample = min(sample, os.stat(src_path).st_size)
+    buffers = [buffer for buffer in buffers if buffer <= sample]
+
+    if len(buffers) < 2:
+        return default
+
+    speeds = []
+
+    with open(src_path, "rb", 0) as src, \
+            NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(dst_path)), prefix=".fctune") as dst:
+
+        for buffer in buffers:
+            advise(src.fileno(), "DONTNEED", 0, sample)
+            src.seek(0)
+            dst.seek(0)
+
+            start = time.time()
+            copied = 0
+
+            # the whole sample including tail, so each buffer size copies the same bytes
+            while copied < sample:
+                chunk = src.read(min(buffer, sample - copied))
+
+                if not chunk:
+                    break
+
+                dst.write(chunk)
+                copied += len(chunk)
+
+            dst.flush()
+            os.fsync(dst.fileno())
+
+            speeds.append((copied / max(time.time() - start, 1e-9), buffer))
+
+    TUNED_BUFFERS[key] = max(speeds)[1]
+
+    logging.info(u"Buffer <{}> is chosen for devices <{}>".format(TUNED_BUFFERS[key], key))
+
+    if cache_path:
+        with open(cache_path, "w") as cache:
+            json.dump(TUNED_BUFFERS, cache)
+
+    return TUNED_BUFFERS[key]
+
+
+def get_hasher(name):
+    """Hash object creation
+
+    Args:
+        name (str): Name of hashlib algorithm or xxhash one, e.g. `blake2b`, `xxh64`, `xxh3_128`
+
+    Returns:
+        object: Hash object with `update` and `hexdigest`
+
+    Raises:
+        ValueError: if algorithm is not available
+    """
+
+    if name.startswith("xxh"):
+        if xxhash is None or not hasattr(xxhash, name):
+            raise ValueError(exc_msg(u"Hash <{}> is not available, xxhash is not installed or too old".format(name)))
+
+        return getattr(xxhash, name)()
+
+    return hashlib.new(name)
+
+
+def read_journal(journal_path, header):
+    """Reading checkpoints of resumable copy
+
+    Args:
+        journal_path (str): Path to journal
+        header (str): Expected first line, one describes source and buffer
+
+    Returns:
+        list(tuple(int, int, str)): Offsets, lengths and digests of copied chunks,
+            empty if journal is missing or was written for another source or buffer
+    """
+
+    if not os.path.exists(journal_path):
+        return []
+
+    with open(journal_path) as journal:
+        if journal.readline() != header:
+            logging.info(u"Journal <{}> does not match source, copy is started over".format(journal_path))
+
+            return []
+
+        checkpoints = []
+
+        for line in journal:
+            # the last line may be written partially
+            try:
+                offset, length, digest = line.split()
+                checkpoints.append((int(offset), int(length), digest))
+
+            except ValueError:
+                break
+
+    return checkpoints
+
+
+def verify_checkpoints(dst, checkpoints, hasher, tail=VERIFY_CHECKPOINTS):
+    """Verifying destination chunks by journal
+
+    Args:
+        dst (file): Destination file opened for reading
+        checkpoints (list(tuple(int, int, str))): Offsets, lengths and digests of copied chunks
+        hasher (object): Hash object, one is updated by verified chunks, may be None
+        tail (int): Number of the last checkpoints are verified if `hasher` is not set,
+            others are synced before writing to journal and trusted. Default is VERIFY_CHECKPOINTS
+
+    Returns:
+        list(tuple(int, int, str)): Checkpoints up to the first one does not match destination
+
+    All chunks are read if `hasher` is set, source hash needs the whole copied part anyway.
+    """
+
+    offset = 0
+
+    for index, (chunk_offset, length, digest) in enumerate(checkpoints):
+        if chunk_offset != offset:
+            return checkpoints[:index]
+
+        offset += length
+
+    start = 0 if hasher is not None else max(len(checkpoints) - tail, 0)
+
+    dst.seek(checkpoints[start][0] if checkpoints else 0)
+
+    for index in range(start, len(checkpoints)):
+        length, digest = checkpoints[index][1:]
+        chunk = dst.read(length)
+
+        if len(chunk) != length or hashlib.new(JOURNAL_DIGEST, chunk).hexdigest() != digest:
+            return checkpoints[:index]
+
+        if hasher is not None:
+            hasher.update(chunk)
+
+    return checkpoints
+
+
+def sync_checkpoints(dst, journal, pending):
+    """Persisting checkpoints of copied chunks
+
+    Args:
+        dst (file): Destination file
+        journal (file): Journal opened for writing
+        pending (list(tuple(int, int, str))): Checkpoints are not written yet, list is cleared
+
+    Returns:
+        None
+
+    Destination is synced before journal is written, so each checkpoint describes data on disk.
+    """
+
+    if not pending:
+        return
+
+    os.fsync(dst.fileno())
+
+    journal.writelines(u"{} {} {}\n".format(*checkpoint) for checkpoint in pending)
+    journal.flush()
+    os.fsync(journal.fileno())
+
+    del pending[:]
+
+
+def resumecopy(src_path, dst_path, buffer, rm_on_err=True, hash_name=None, progress=None):
+    """Resumable copy with checkpoint journal
+
+    Args:
+        src_path (str): Path to source file
+        src_path (str): Path to destination file
+        buffer (int): Copy buffer size, that is also checkpoint size
+        rm_on_err (bool): Ignored, destination and journal are kept on error or interruption for resume
+        hash_name (str): If set, source hash is calculated in the same pass, see `get_hasher`
+        progress (function): If set, one is called with Progress at most once per PROGRESS_INTERVAL and at the end
+
+    Returns:
+        str: Hex digest of source if `hash_name` is set, otherwise None
+
+    Raises:
+        Exception: excluding KeyboardInterrupt
+
+    Digest of each copied chunk is appended to journal `dst_path + JOURNAL_SUFFIX` after destination is synced,
+    that is done each JOURNAL_SYNC bytes and on error or interruption. If journal exists, the last
+    VERIFY_CHECKPOINTS chunks of destination are verified against it and copy is resumed from the first
+    mismatched one, the whole copied part is read again only if `hash_name` is set.
+    Journal is started over if source size, modification time or buffer changed, and deleted after copy.
+    Use `functools.partial(resumecopy, hash_name=..., progress=...)` as `copy_engine`.
+    """
+
+    journal_path = dst_path + JOURNAL_SUFFIX
+    hasher = get_hasher(hash_name) if hash_name else None
+    # hash of interrupted copy is not returned
+    src_digest = None
+
+    src_stat = os.stat(src_path)
+    header = u"{} {} {}\n".format(src_stat.st_size, getattr(src_stat, "st_mtime_ns", src_stat.st_mtime), buffer)
+
+    # destination is kept, it is resumed next time
+    with copy_guard(dst_path, False):
+        with open(src_path, "rb", 0) as src, open(dst_path, "r+b" if os.path.exists(dst_path) else "w+b", 0) as dst:
+
+            checkpoints = verify_checkpoints(dst, read_journal(journal_path, header), hasher)
+            offset = sum(length for _, length, _ in checkpoints)
+
+            if offset:
+                logging.info(u"Resuming copy from <{}>".format(offset))
+
+            # journal is rewritten without unverified tail
+            with open(journal_path, "w") as journal:
+                journal.write(header)
+                journal.writelines(u"{} {} {}\n".format(*checkpoint) for checkpoint in checkpoints)
+                journal.flush()
+
+                start, resumed, reported = time.time(), offset, 0.0
+                # checkpoints of chunks are not synced yet
+                pending = []
+
+                src.seek(offset)
+                dst.seek(offset)
+
+                try:
+                    chunk = src.read(buffer)
+
+                    while chunk:
+                        dst.write(chunk)
+
+                        if hasher is not None:
+                            hasher.update(chunk)
+
+                        pending.append((offset, len(chunk), hashlib.new(JOURNAL_DIGEST, chunk).hexdigest()))
+
+                        offset += len(chunk)
+
+                        if len(pending) * buffer >= JOURNAL_SYNC:
+                            sync_checkpoints(dst, journal, pending)
+
+                        if progress is not None and time.time() - reported >= PROGRESS_INTERVAL:
+                            reported = time.time()
+                            progress(get_progress(offset, src_stat.st_size, offset - resumed, reported - start))
+
+                        chunk = src.read(buffer)
+
+                # copied chunks are kept for resume on error or interruption
+                except BaseException:
+                    sync_checkpoints(dst, journal, pending)
+
+                    raise
+
+                dst.truncate(offset)
+
+            if progress is not None:
+                progress(get_progress(offset, src_stat.st_size, offset - resumed, time.time() - start))
+
+        os.remove(journal_path)
+
+        src_digest = hasher.hexdigest() if hasher is not None else None
+
+    return src_digest
+
+
+def get_progress(copied, total, session_copied, seconds):
+    """Progress calculation
+
+    Args:
+        copied (int): Copied bytes including resumed ones
+        total (int): Source size
+        session_copied (int): Bytes copied since start or resume
+        seconds (float): Seconds since start or resume
+
+    Returns:
+        Progress: Copied and total bytes, bytes per second and estimated seconds left, eta is None if speed is unknown
+    """
+
+    speed = session_copied / seconds if seconds > 0 else 0.0
+
+    return Progress(copied, total, speed, (total - copied) / speed if speed else None)
+
+
+def kernel_loop(copy_chunk, name):
+    """Calling kernel copy function until source end
+
+    Args:
+        copy_chunk (function): Function copies up to given number of bytes, returns number of copied bytes
+        name (unicode): Name of kernel function for messages
+
+    Returns:
+        int: Number of copied bytes
+
+    Raises:
+        EngineNotSupported: if the first call failed with one of UNSUPPORTED_ERRNOS
+        OSError
+    """
+
+    copied = 0
+
+    while True:
+        try:
+            sent = copy_chunk(KERNEL_CHUNK)
+
+        except OSError as err:
+            # nothing was copied, another engine may be used
+            if not copied and err.errno in UNSUPPORTED_ERRNOS:
+                raise EngineNotSupported(u"{} is not supported: {}".format(name, err))
+
+            raise
+
+        if not sent:
+            return copied
+
+        copied += sent
+
+
+def cfrcopy(src_path, dst_path, buffer, rm_on_err=True):
+    """Copy using `os.copy_file_range`
+
+    Args:
+        src_path (str): Path to source file
+        src_path (str): Path to destination file
+        buffer (int): Copy buffer size, not used, data is not copied to userspace
+        rm_on_err (bool): If set, deleting destination file on error or interruption. Default is True.
+
+    Returns:
+        None
+
+    Raises:
+        EngineNotSupported: if there is no `os.copy_file_range` (Python < 3.8, non Linux)
+            or kernel/fs does not support it for given files
+        Exception: excluding KeyboardInterrupt
+
+    Data is copied inside kernel, fs may do it without copy at all (reflink) or on server side (NFS, SMB).
+    """
+
+    copy_range = getattr(os, "copy_file_range", None)
+
+    if copy_range is None:
+        raise EngineNotSupported(u"os.copy_file_range is not available")
+
+    with copy_guard(dst_path, rm_on_err):
+        with open(src_path, "rb", 0) as src, open_dst(dst_path) as dst:
+
+            copied = kernel_loop(lambda count: copy_range(src.fileno(), dst.fileno(), count), u"copy_file_range")
+
+            os.ftruncate(dst.fileno(), copied)
+
+
+def sfcopy(src_path, dst_path, buffer, rm_on_err=True):
+    """Copy using `os.sendfile`
+
+    Args:
+        src_path (str): Path to source file
+        src_path (str): Path to destination file
+        buffer (int): Copy buffer size, not used, data is not copied to userspace
+        rm_on_err (bool): If set, deleting destination file on error or interruption. Default is True.
 
     Returns:
-        str: Encoded message
+        None
+
+    Raises:
+        EngineNotSupported: if there is no `os.sendfile` or it can not write to regular file on current platform
+        Exception: excluding KeyboardInterrupt
+
+    Data is copied inside kernel through page cache, file to file sendfile is supported by Linux 2.6.33+.
     """
-    return msg.encode(encoding)
 
+    sendfile = getattr(os, "sendfile", None)
 
-def path_validation(path, length):
-    """Validation and normalization of given path
+    if sendfile is None or not sys.platform.startswith("linux"):
+        raise EngineNotSupported(u"os.sendfile to regular file is not available")
+
+    with copy_guard(dst_path, rm_on_err):
+        with open(src_path, "rb", 0) as src, open_dst(dst_path) as dst:
+
+            copied = kernel_loop(lambda count: sendfile(dst.fileno(), src.fileno(), None, count), u"sendfile")
+
+            os.ftruncate(dst.fileno(), copied)
+
+
+def refcopy(src_path, dst_path, buffer, rm_on_err=True):
+    """Copy using reflink (`ioctl FICLONE`)
 
     Args:
-        path (unicode): Path to file
-        length (unicode): Max possible path length
+        src_path (str): Path to source file
+        src_path (str): Path to destination file
+        buffer (int): Copy buffer size, not used, data is not copied at all
+        rm_on_err (bool): If set, deleting destination file on error or interruption. Default is True.
 
     Returns:
-        str: normalized path
+        None
 
     Raises:
-        ValueError
+        EngineNotSupported: if there is no `fcntl` or fs does not support reflinks (Btrfs, XFS, etc support them)
+            or files are on different fs
+        Exception: excluding KeyboardInterrupt
+
+    Destination shares extents of source file, copy on write is done by fs on later changes.
     """
-    # For windows long name prefix `\\?\` will be added
 
-    # normilizers for given path
-    normilizers = [
-        os.path.expandvars,
-        os.path.expanduser,
-        os.path.normpath,
-        os.path.normcase]
+    if fcntl is None or not sys.platform.startswith("linux"):
+        raise EngineNotSupported(u"ioctl FICLONE is not available")
 
-    # empty path is not allowed
-    if not path:
-        raise ValueError(u"Empty path")
+    with copy_guard(dst_path, rm_on_err):
+        with open(src_path, "rb", 0) as src, open_dst(dst_path) as dst:
 
-    # support of long name in windows
-    # adding long name `\\?\` prefix
-    if sys.platform.startswith('win') and not path.startswith(u"\\\\?\\"):
-        path = u"\\\\?\\" + path
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
 
-    # getting normilized path
-    path = reduce(lambda a, f: f(a), normilizers, path)
+            except (IOError, OSError) as err:
+                if err.errno in UNSUPPORTED_ERRNOS:
+                    raise EngineNotSupported(u"FICLONE is not supported: {}".format(err))
 
-    # path is too long
-    if len(path) > length:
-        raise ValueError(
-            exc_msg(u"Path <{}> is too long <{}>. Max path length is <{}>".format(path, len(path), length)))
+                raise
 
-    # path is not regular file
-    if os.path.exists(path) and not stat.S_ISREG(os.stat(path).st_mode):
-        raise ValueError(exc_msg(u"Path <{}> is not a regular file".format(path)))
+            os.ftruncate(dst.fileno(), os.fstat(src.fileno()).st_size)
 
-    return path
 
+def split_ranges(size, parts, buffer):
+    """Splitting file into ranges
+
+    Args:
+        size (int): File size
+        parts (int): Desired number of ranges
+        buffer (int): Copy buffer size, ranges are aligned by it
+
+    Returns:
+        list(tuple(int, int)): Offsets and lengths of ranges
+    """
+
+    # range size is rounded up to buffer
+    length = max(buffer, -(-size // max(1, parts) // buffer) * buffer)
+
+    return [(offset, min(length, size - offset)) for offset in range(0, size, length)]
 
-def get_mmsrc(src):
-    """Source mmap creation
+
+def copy_range(src_fd, dst_fd, offset, length, buffer, stop):
+    """Copy of file range with explicit offsets, file positions are not used, so fds are shared between threads
 
     Args:
-        src (str): Path to file
+        src_fd (int): Source file descriptor
+        dst_fd (int): Destination file descriptor
+        offset (int): Range offset
+        length (int): Range length
+        buffer (int): Copy buffer size
+        stop (threading.Event): If set, copy is stopped on the next chunk
 
     Returns:
-        mmap.mmap: mmap obj of source file for current platform
+        None
+
+    Raises:
+        IOError: if source is shorter than expected
+        OSError
+
+    `os.copy_file_range` with offsets is used if possible, otherwise `os.pread`/`os.pwrite`.
     """
 
-    # win mmap is different than *nix
-    if sys.platform.startswith('win') or sys.platform.startswith('cygwin'):
-        return mmap.mmap(src.fileno(), 0, None, mmap.ACCESS_READ, 0)
+    copy_file_range = getattr(os, "copy_file_range", None)
+    end = offset + length
 
-    # *nix mmap
-    return mmap.mmap(src.fileno(), 0, mmap.MAP_SHARED, mmap.PROT_READ, 0, 0)
+    while offset < end and not stop.is_set():
+        count = min(buffer, end - offset)
 
+        if copy_file_range is not None:
+            try:
+                sent = copy_file_range(src_fd, dst_fd, count, offset, offset)
 
-def mmcopy(src_path, dst_path, buffer, rm_on_err=True):
-    """Copy using mmap
+            except OSError as err:
+                if err.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+
+                # switching to userspace copy for the rest of range
+                copy_file_range = None
+                continue
+
+        else:
+            chunk = memoryview(os.pread(src_fd, count, offset))
+            sent = 0
+
+            while sent < len(chunk):
+                sent += os.pwrite(dst_fd, chunk[sent:], offset + sent)
+
+        if not sent:
+            raise IOError(exc_msg(u"Source file is truncated at <{}>".format(offset)))
+
+        offset += sent
+
+
+def parcopy(src_path, dst_path, buffer, rm_on_err=True, workers=4):
+    """Copy of file ranges by thread pool
 
     Args:
         src_path (str): Path to source file
         src_path (str): Path to destination file
-        buffer (int): Copy buffer size
+        buffer (int): Copy buffer size, ranges are aligned by it
         rm_on_err (bool): If set, deleting destination file on error or interruption. Default is True.
+        workers (int): Number of threads. Default is 4
 
     Returns:
         None
 
     Raises:
+        EngineNotSupported: if there is no thread pool or `os.pread`/`os.pwrite`
         Exception: excluding KeyboardInterrupt
+
+    Destination is truncated to source size at first, then ranges are copied concurrently,
+    that helps to saturate NVMe and network fs. If any range fails, other threads stop on their next chunk.
+    Use `functools.partial(parcopy, workers=N)` as `copy_engine` for changing number of threads.
     """
 
-    # preserving UnboundLocalError
-    mmsrc, err = None, None
+    if ThreadPoolExecutor is None or getattr(os, "pread", None) is None:
+        raise EngineNotSupported(u"Thread pool or os.pread/os.pwrite are not available")
 
-    try:
+    with copy_guard(dst_path, rm_on_err):
         with open(src_path, "rb", 0) as src, open(dst_path, "w+b", 0) as dst:
 
-            mmsrc = get_mmsrc(src)
+            size = os.fstat(src.fileno()).st_size
 
-            chunk = mmsrc.read(buffer)
+            # destination has final size, so ranges are written independently
+            os.ftruncate(dst.fileno(), size)
 
-            # writing with chunks
-            while chunk:
+            stop = threading.Event()
 
-                dst.write(chunk)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(copy_range, src.fileno(), dst.fileno(), offset, length, buffer, stop)
+                           for offset, length in split_ranges(size, workers * RANGES_PER_WORKER, buffer)]
 
-                chunk = mmsrc.read(buffer)
+                try:
+                    for future in futures:
+                        future.result()
 
-    except KeyboardInterrupt as err:
-        logging.info(u"Ctrl+C interruption")
+                # stopping other threads on error or interruption
+                except BaseException:
+                    stop.set()
 
-    # there are many type of errors can happened and mmap objs have to be closed in all cases
-    except Exception as err:
-        logging.error(u"An error occured during copy file")
-        logging.exception(err)
+                    raise
 
-    finally:
-        getattr(mmsrc, "close", lambda: None)()
 
-        # deleting dst
-        if err is not None and os.path.exists(dst_path):
-            logging.info(u"Removing destination <{}>".format(dst_path))
+def get_extents(fd, size):
+    """Data extents of file, holes are skipped
 
-            os.remove(dst_path)
+    Args:
+        fd (int): File descriptor
+        size (int): File size
+
+    Yields:
+        tuple(int, int): Offset and length of each data extent
+    """
+
+    offset = 0
+
+    while offset < size:
+        try:
+            offset = os.lseek(fd, offset, os.SEEK_DATA)
+
+        # there is no data after offset
+        except OSError as err:
+            if err.errno == errno.ENXIO:
+                return
 
-        # raising exceptions excluding KeyboardInterrupt
-        if err is not None and err is not KeyboardInterrupt:
             raise
 
+        end = os.lseek(fd, offset, os.SEEK_HOLE)
+
+        yield offset, end - offset
+
+        offset = end
+
+
+def sparsecopy(src_path, dst_path, buffer, rm_on_err=True):
+    """Copy of data extents of sparse file (`lseek SEEK_DATA/SEEK_HOLE`)
+
+    Args:
+        src_path (str): Path to source file
+        src_path (str): Path to destination file
+        buffer (int): Copy buffer size
+        rm_on_err (bool): If set, deleting destination file on error or interruption. Default is True.
+
+    Returns:
+        None
+
+    Raises:
+        EngineNotSupported: if there is no SEEK_DATA/SEEK_HOLE or source is not sparse
+        Exception: excluding KeyboardInterrupt
+
+    Destination is truncated to source size at first, so holes are not written and stay holes,
+    only allocated extents are read and copied.
+    """
+
+    if getattr(os, "SEEK_DATA", None) is None or getattr(os, "pread", None) is None:
+        raise EngineNotSupported(u"lseek SEEK_DATA/SEEK_HOLE is not available")
+
+    src_stat = os.stat(src_path)
+
+    # fs may report allocated blocks only, e.g. st_blocks is missing on windows
+    if getattr(src_stat, "st_blocks", src_stat.st_size) * 512 >= src_stat.st_size:
+        raise EngineNotSupported(u"Source file is not sparse")
+
+    with copy_guard(dst_path, rm_on_err):
+        with open(src_path, "rb", 0) as src, open(dst_path, "w+b", 0) as dst:
+
+            os.ftruncate(dst.fileno(), src_stat.st_size)
+
+            # single thread, so stop is never set
+            stop = threading.Event()
+
+            for offset, length in get_extents(src.fileno(), src_stat.st_size):
+                copy_range(src.fileno(), dst.fileno(), offset, length, buffer, stop)
+
+
+# engines are tried by `autocopy` in the given order, from the cheapest one
+AUTO_ENGINES = (refcopy, sparsecopy, cfrcopy, sfcopy)
+
+
+def autocopy(src_path, dst_path, buffer, rm_on_err=True, engines=AUTO_ENGINES, fallback=mmcopy):
+    """Copy using the first supported engine
+
+    Args:
+        src_path (str): Path to source file
+        src_path (str): Path to destination file
+        buffer (int): Copy buffer size
+        rm_on_err (bool): If set, deleting destination file on error or interruption. Default is True.
+        engines (tuple): Engines which raise EngineNotSupported if they can not be used. Default is AUTO_ENGINES
+        fallback (function): Engine is used if none of `engines` is supported. Default is mmcopy
+
+    Returns:
+        None
+
+    Raises:
+        Exception: excluding KeyboardInterrupt
+    """
+
+    for engine in engines:
+        try:
+            return engine(src_path, dst_path, buffer, rm_on_err)
+
+        except EngineNotSupported as err:
+            logging.debug(u"Engine <{}> is skipped: {}".format(engine.__name__, err))
+
+    return fallback(src_path, dst_path, buffer, rm_on_err)
+
+
+# engines copy data inside kernel, buffer is not used by them, autocopy uses it only if none of them is supported
+KERNEL_ENGINES = (refcopy, cfrcopy, sfcopy, autocopy)
+
+
+def uses_buffer(copy_engine):
+    """Checking if buffer size matters for engine, so it is worth tuning
+
+    Args:
+        copy_engine (function): Engine or `functools.partial` of it
+
+    Returns:
+        bool: False for KERNEL_ENGINES, otherwise True
+    """
+
+    return getattr(copy_engine, "func", copy_engine) not in KERNEL_ENGINES
+
 
 def user_input():
     """Simple user input function. One asks for source and destination paths.
@@ -155,8 +1184,8 @@ def user_input():
 def copy(src_path, dst_path, src_len=1024, dst_len=3096,
             save_perm=False, rm_on_err=True,
             buffer=(512 * mmap.PAGESIZE),
-            validate=path_validation, copy_engine=mmcopy):
-    """Copy file, using especial engine defined in args, default is copy by using mmap.
+            validate=path_validation, copy_engine=autocopy, tune=False):
+    """Copy file, using especial engine defined in args, default is autocopy (kernel side copy, mmap if unsupported).
 
     Args:
         src_path (unicode): Source path to file
@@ -167,10 +1196,13 @@ def copy(src_path, dst_path, src_len=1024, dst_len=3096,
         rm_on_err (bool): If set, deleting destination file on copy error or interruption. Default is True
         buffer (int): Copy buffer size. Default is 2Mb, that is heuristic value, individual for each system
         validate (function): Function validates and normilizes given paths. Default is path_validation
-        copy_engine (function): Funtion copies files. Default is mmcopy
+        copy_engine (function): Funtion copies files. Default is autocopy, it uses kernel side copy if possible
+            and mmcopy otherwise
+        tune (bool): If set, `buffer` is chosen by `tune_buffer` for source and destination devices,
+            tuning is skipped for engines which do not use buffer, see `uses_buffer`
 
     Returns:
-        None
+        object: Result of copy engine, e.g. hash digest of resumecopy
 
     Raises:
         ValueError: if path validation failed
@@ -211,10 +1243,16 @@ def copy(src_path, dst_path, src_len=1024, dst_len=3096,
 
         raise ValueError(exc_msg(msg))
 
+    if tune and uses_buffer(copy_engine):
+        buffer = tune_buffer(src, dst, buffer)
+
+    elif tune:
+        logging.info(u"Tuning is skipped, engine does not use buffer")
+
     logging.info(u"Starting copy <{}> to <{}>".format(src, dst))
 
     # copy file
-    copy_engine(src, dst, buffer, rm_on_err)
+    result = copy_engine(src, dst, buffer, rm_on_err)
 
     logging.info(u"Copy done")
 
@@ -223,3 +1261,256 @@ def copy(src_path, dst_path, src_len=1024, dst_len=3096,
         os.chmod(dst, stat.S_IMODE(os.stat(src).st_mode))
 
         logging.info(u"Permission on destination file changed")
+
+    return result
+
+
+def walk_tree(src_dir, dst_dir):
+    """Walking directory tree
+
+    Args:
+        src_dir (str): Path to source directory
+        dst_dir (str): Path to destination directory
+
+    Yields:
+        tuple(str, str, os.stat_result): Source path, destination path and source stat of each directory
+            and regular file, directory goes before its content
+
+    Symlinks and special files are skipped. Nothing is created, so the whole tree has to be walked
+    before destination directories are created, see `copy_tree`.
+    """
+
+    for entry in os.scandir(src_dir):
+        dst_path = os.path.join(dst_dir, entry.name)
+
+        if entry.is_dir(follow_symlinks=False):
+            yield entry.path, dst_path, entry.stat(follow_symlinks=False)
+
+            for item in walk_tree(entry.path, dst_path):
+                yield item
+
+        elif entry.is_file(follow_symlinks=False):
+            yield entry.path, dst_path, entry.stat(follow_symlinks=False)
+
+        else:
+            logging.info(u"Skipping <{}>, it is not a regular file".format(entry.path))
+
+
+def get_batches(files):
+    """Grouping files to worker tasks
+
+    Args:
+        files (list(tuple(str, str, os.stat_result))): Source paths, destination paths and source stats
+
+    Returns:
+        list(list(tuple(str, str, os.stat_result))): Batches, large files are alone and go first,
+            small ones are grouped by BATCH_FILES and BATCH_SIZE
+    """
+
+    large = [[item] for item in files if item[2].st_size > SMALL_FILE_SIZE]
+    large.sort(key=lambda batch: batch[0][2].st_size, reverse=True)
+
+    batches, batch, size = [], [], 0
+
+    for item in files:
+        if item[2].st_size > SMALL_FILE_SIZE:
+            continue
+
+        if len(batch) == BATCH_FILES or size + item[2].st_size > BATCH_SIZE:
+            batches.append(batch)
+            batch, size = [], 0
+
+        batch.append(item)
+        size += item[2].st_size
+
+    if batch:
+        batches.append(batch)
+
+    return large + batches
+
+
+def copy_batch(batch, buffer, save_perm, rm_on_err, copy_engine, stop):
+    """Copy of files batch by one worker
+
+    Args:
+        batch (list(tuple(str, str, os.stat_result))): Source paths, destination paths and source stats
+        buffer (int): Copy buffer size
+        save_perm (bool): Copy file permissions from source to destination
+        rm_on_err (bool): If set, deleting destination file on copy error or interruption
+        copy_engine (function): Funtion copies files larger than SMALL_FILE_SIZE, small ones are copied by rwcopy
+        stop (threading.Event): If set, the rest of batch is skipped
+
+    Returns:
+        tuple(int, int): Number of copied files and bytes
+    """
+
+    files, size = 0, 0
+
+    for src_path, dst_path, src_stat in batch:
+        if stop.is_set():
+            break
+
+        engine = rwcopy if src_stat.st_size <= SMALL_FILE_SIZE else copy_engine
+        engine(src_path, dst_path, buffer, rm_on_err)
+
+        if save_perm:
+            os.chmod(dst_path, stat.S_IMODE(src_stat.st_mode))
+
+        files += 1
+        size += src_stat.st_size
+
+    return files, size
+
+
+def copy_tree(src_dir, dst_dir, workers=4, save_perm=False, rm_on_err=True,
+              buffer=(512 * mmap.PAGESIZE), copy_engine=autocopy):
+    """Copy directory tree by pool of threads
+
+    Args:
+        src_dir (unicode): Source directory
+        dst_dir (unicode): Destination directory, one is created if missing
+        workers (int): Number of threads. Default is 4
+        save_perm (bool): Copy file permissions from source to destination
+        rm_on_err (bool): If set, deleting destination file on copy error or interruption. Default is True
+        buffer (int): Copy buffer size. Default is 2Mb
+        copy_engine (function): Funtion copies files larger than SMALL_FILE_SIZE. Default is autocopy
+
+    Returns:
+        CopyStats: Number of files, bytes and seconds of copy
+
+    Raises:
+        ValueError: if source is not directory or destination is inside source
+        EngineNotSupported: if there is no thread pool
+        Exception: the first error of workers, excluding KeyboardInterrupt
+
+    Files are not validated one by one like by `copy`, the tree is walked once by `os.scandir`.
+    Small files are copied by read/write in batches, that saves task and mmap setup per file.
+    On error or interruption the rest of files is not copied, stats of interrupted copy count copied files only.
+    """
+
+    if ThreadPoolExecutor is None:
+        raise EngineNotSupported(u"Thread pool is not available")
+
+    if not os.path.isdir(src_dir):
+        msg = u"Source <{}> is not a directory".format(src_dir)
+        logging.error(msg)
+
+        raise ValueError(exc_msg(msg))
+
+    real_src, real_dst = os.path.realpath(src_dir), os.path.realpath(dst_dir)
+
+    # copied directories would be walked as source again
+    if real_dst == real_src or real_dst.startswith(os.path.join(real_src, u"")):
+        msg = u"Destination <{}> is inside source <{}>".format(dst_dir, src_dir)
+        logging.error(msg)
+
+        raise ValueError(exc_msg(msg))
+
+    logging.info(u"Starting copy of tree <{}> to <{}>".format(src_dir, dst_dir))
+
+    start = time.time()
+
+    items = list(walk_tree(src_dir, dst_dir))
+
+    # parent directory goes before its subdirectories
+    for dst_path in [dst_dir] + [dst_path for _, dst_path, src_stat in items if stat.S_ISDIR(src_stat.st_mode)]:
+        if not os.path.isdir(dst_path):
+            os.makedirs(dst_path)
+
+    files = [item for item in items if not stat.S_ISDIR(item[2].st_mode)]
+    stop = threading.Event()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(copy_batch, batch, buffer, save_perm, rm_on_err, copy_engine, stop)
+                   for batch in get_batches(files)]
+
+        try:
+            for future in futures:
+                future.result()
+
+        except KeyboardInterrupt:
+            logging.info(u"Ctrl+C interruption")
+
+            stop.set()
+
+        # stopping other threads on error
+        except BaseException:
+            stop.set()
+
+            raise
+
+    # workers are finished, interrupted ones return the part of batch they copied
+    counts = [future.result() for future in futures]
+
+    stats = CopyStats(sum(count[0] for count in counts), sum(count[1] for count in counts), time.time() - start)
+
+    logging.info(u"Copy {}: <{}> of <{}> files, <{}> bytes, <{:.1f}> MB/s".format(
+        u"interrupted" if stop.is_set() else u"done", stats.files, len(files), stats.size,
+        stats.size / (1024.0 * 1024.0) / max(stats.seconds, 1e-9)))
+
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="""Fast file copy.
+                                     If source is directory, the tree is copied by pool of threads
+                                     and aggregate throughput is printed.""")
+    parser.add_argument("src", help="Source file or directory")
+    parser.add_argument("dst", help="Destination file or directory")
+    parser.add_argument("-j", "--workers", type=int, default=4,
+                        help="Number of threads for directory copy. Default is 4")
+    parser.add_argument("-b", "--buffer", type=int, default=512 * mmap.PAGESIZE,
+                        help="Copy buffer size. Default is 2Mb")
+    parser.add_argument("-p", "--save-perm", action="store_true",
+                        help="Copy file permissions from source to destination")
+    parser.add_argument("-k", "--keep-on-error", action="store_true",
+                        help="Do not delete destination file on copy error or interruption")
+    parser.add_argument("-r", "--resume", action="store_true",
+                        help="Resumable copy of single file with checkpoint journal next to destination")
+    parser.add_argument("--hash",
+                        help="Hash of source calculated during resumable copy, e.g. blake2b or xxh64")
+    parser.add_argument("-t", "--tune", action="store_true",
+                        help="Choose buffer size by short benchmark of source and destination devices, "
+                             "used with --resume, --hash and --direct, other engines copy inside kernel")
+    parser.add_argument("--tune-cache",
+                        help="Path to JSON file keeping tuned buffer sizes between runs")
+    parser.add_argument("-d", "--direct", action="store_true",
+                        help="Copy single file with O_DIRECT, page cache is not evicted")
+    opts = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    # default kernel engines and tree copy do not use tuned buffer
+    if opts.tune and not os.path.isdir(opts.src) and (opts.resume or opts.hash or opts.direct):
+        opts.buffer = tune_buffer(opts.src, opts.dst, opts.buffer, cache_path=opts.tune_cache)
+
+    elif opts.tune:
+        logging.info(u"Tuning is skipped, engine does not use buffer")
+
+    if os.path.isdir(opts.src):
+        stats = copy_tree(opts.src, opts.dst, opts.workers, opts.save_perm, not opts.keep_on_error, opts.buffer)
+
+        print(u"{} files, {} bytes, {:.3f} s, {:.1f} MB/s".format(
+            stats.files, stats.size, stats.seconds, stats.size / (1024.0 * 1024.0) / max(stats.seconds, 1e-9)))
+
+    elif opts.resume or opts.hash:
+        def print_progress(state):
+            print(u"{:.1f}% {:.1f} MB/s, ETA {} s".format(
+                100.0 * state.copied / max(state.total, 1), state.speed / (1024.0 * 1024.0),
+                u"?" if state.eta is None else int(state.eta)))
+
+        digest = copy(opts.src, opts.dst, save_perm=opts.save_perm, buffer=opts.buffer,
+                      copy_engine=partial(resumecopy, hash_name=opts.hash, progress=print_progress))
+
+        if digest:
+            print(u"{} {}".format(opts.hash, digest))
+
+    else:
+        try:
+            copy(opts.src, opts.dst, save_perm=opts.save_perm, rm_on_err=not opts.keep_on_error, buffer=opts.buffer,
+                 copy_engine=directcopy if opts.direct else autocopy)
+
+        except EngineNotSupported as err:
+            logging.warning(u"{}, copying through page cache".format(err))
+
+            copy(opts.src, opts.dst, save_perm=opts.save_perm, rm_on_err=not opts.keep_on_error, buffer=opts.buffer)
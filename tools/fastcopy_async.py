@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastcopy import copy_range, get_progress, path_validation, remove_dst
+
+
+# number of buffers copied by one thread call, progress is yielded and cancellation is checked between steps
+PROGRESS_STEP = 64
+
+
+class AsyncCopier(object):
+    """Copy of files from asyncio code, copy itself runs in threads
+
+    Args:
+        concurrency (int): Max number of copies in progress, that is also number of copy threads. Default is 4
+        buffer (int): Copy buffer size. Default is 2Mb
+
+    Each copy is async generator of fastcopy.Progress, so consumer paces and may cancel it. Cancellation
+    (or closing generator before the end) stops copy after current chunk and deletes destination file
+    like Ctrl+C does in fastcopy engines, but CancelledError is raised further as asyncio requires.
+    Consumer has to close generator explicitly, e.g. by `contextlib.aclosing` (Python 3.10+)
+    or `await progresses.aclose()` in `finally`, otherwise cleanup waits for generator finalization.
+    """
+
+    def __init__(self, concurrency=4, buffer=(512 * mmap.PAGESIZE)):
+        self.concurrency = concurrency
+        self.buffer = buffer
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def run(self, stop, func, *args):
+        """Running function in copy thread, thread is waited on cancellation
+
+        Args:
+            stop (threading.Event): One is set on cancellation to stop function early
+            func (function): Function
+            args: Arguments of function
+
+        Returns:
+            object: Result of function
+        """
+
+        future = asyncio.wrap_future(self.executor.submit(func, *args))
+
+        try:
+            return await asyncio.shield(future)
+
+        except asyncio.CancelledError:
+            stop.set()
+
+            # files are used by thread until it returns
+            await asyncio.wait([future])
+
+            raise
+
+    async def copy(self, src_path, dst_path, rm_on_err=True, engine=None):
+        """Copy of file
+
+        Args:
+            src_path (str): Path to source file
+            dst_path (str): Path to destination file
+            rm_on_err (bool): If set, deleting destination file on error or cancellation. Default is True
+            engine (function): If set, fastcopy engine copies file by one call, e.g. fastcopy.autocopy,
+                then cancellation waits for the end of copy and only final progress is yielded.
+                Default is copy by PROGRESS_STEP buffers with `os.copy_file_range` or `os.pread`/`os.pwrite`
+
+        Yields:
+            fastcopy.Progress: Progress after each step
+
+        Raises:
+            ValueError: if path validation failed, source does not exist or it is the same file as destination
+            asyncio.CancelledError
+            Exception
+
+        Generator has to be closed by consumer, see AsyncCopier.
+        """
+
+        src_path, dst_path = path_validation(src_path, 1024), path_validation(dst_path, 3096)
+
+        # destination is truncated, so the same file would be lost
+        if not os.path.exists(src_path):
+            raise ValueError(u"Source file <{}> does not exist".format(src_path))
+
+        if os.path.exists(dst_path) and os.path.samefile(src_path, dst_path):
+            raise ValueError(u"Source file <{}> is the same as destination file <{}>".format(src_path, dst_path))
+        stop = threading.Event()
+        # consumer may close generator on the last progress, copy is not cancelled then
+        done = False
+
+        async with self.semaphore:
+            logging.info(u"Starting copy <{}> to <{}>".format(src_path, dst_path))
+
+            start = time.time()
+
+            try:
+                if engine is not None:
+                    size = os.stat(src_path).st_size
+
+                    await self.run(stop, engine, src_path, dst_path, self.buffer, rm_on_err)
+
+                    done = True
+                    yield get_progress(size, size, size, time.time() - start)
+
+                else:
+                    with open(src_path, "rb", 0) as src, open(dst_path, "w+b", 0) as dst:
+
+                        size = os.fstat(src.fileno()).st_size
+
+                        # ranges are written by offsets
+                        os.ftruncate(dst.fileno(), size)
+
+                        # empty file has one empty step
+                        for offset in range(0, max(size, 1), self.buffer * PROGRESS_STEP):
+                            length = min(self.buffer * PROGRESS_STEP, size - offset)
+
+                            await self.run(stop, copy_range, src.fileno(), dst.fileno(), offset, length,
+                                           self.buffer, stop)
+
+                            done = offset + length == size
+                            yield get_progress(offset + length, size, offset + length, time.time() - start)
+
+            # generator is closed before the end in case of GeneratorExit
+            except (asyncio.CancelledError, GeneratorExit):
+                if done:
+                    raise
+
+                logging.info(u"Copy <{}> is cancelled".format(src_path))
+
+                remove_dst(dst_path, rm_on_err)
+
+                raise
+
+            except Exception as err:
+                logging.error(u"An error occured during copy file")
+                logging.exception(err)
+
+                remove_dst(dst_path, rm_on_err)
+
+                raise
+
+            logging.info(u"Copy done")
+
+    async def copy_all(self, pairs, rm_on_err=True, engine=None):
+        """Concurrent copy of files, at most `concurrency` ones are copied at the same time
+
+        Args:
+            pairs (iterable(tuple(str, str))): Source and destination paths
+            rm_on_err (bool): If set, deleting destination file on error or cancellation. Default is True
+            engine (function): Engine, see `copy`
+
+        Yields:
+            tuple(str, str, fastcopy.Progress): Source and destination paths and progress of one of copies
+
+        Raises:
+            Exception: the first error of copies after all of them are finished
+
+        Copies are cancelled if generator is closed or cancelled, it has to be closed like `copy` one.
+        Queue of events is bounded by `concurrency`, so copies wait for slow consumer.
+        """
+
+        events = asyncio.Queue(self.concurrency)
+
+        async def run(src_path, dst_path):
+            progresses = self.copy(src_path, dst_path, rm_on_err, engine)
+
+            try:
+                async for progress in progresses:
+                    await events.put((src_path, dst_path, progress))
+
+            # consumer is gone, nobody waits for the end of copy
+            except asyncio.CancelledError:
+                raise
+
+            # end of failed copy, error is raised by gather
+            except Exception:
+                await events.put(None)
+
+                raise
+
+            else:
+                await events.put(None)
+
+            # destination of cancelled copy is deleted and semaphore is released right now
+            finally:
+                await progresses.aclose()
+
+        tasks = [asyncio.ensure_future(run(src_path, dst_path)) for src_path, dst_path in pairs]
+
+        try:
+            running = len(tasks)
+
+            while running:
+                event = await events.get()
+
+                if event is None:
+                    running -= 1
+
+                else:
+                    yield event
+
+            await asyncio.gather(*tasks)
+
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        """Waiting for copy threads and releasing them"""
+
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,247 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import resource
+import shutil
+import subprocess
+import time
+from sys import executable, exit
+from tempfile import TemporaryDirectory, gettempdir
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import fastcopy
+
+
+MB: int = 1024 * 1024
+# share of data extents in sparse files, the rest is holes
+SPARSE_DATA: float = 0.1
+# size of each data extent of sparse files
+SPARSE_EXTENT: int = 4 * MB
+# fs types kept in memory, they are not measured as disk
+MEMORY_FS: Tuple[str, ...] = ("tmpfs", "ramfs", "devtmpfs")
+
+
+class Measure(NamedTuple):
+    engine: str
+    location: str
+    size: int
+    sparse: bool
+    # 0 for engines which do not use buffer
+    buffer: int
+    wall: float
+    cpu: float
+    # growth of peak RSS during copy, interpreter and imports are excluded
+    max_rss_kb: int
+    throughput: float
+
+
+def shcopy(src_path: str, dst_path: str, buffer: int, rm_on_err: bool = True) -> None:
+    """`shutil.copyfileobj` as engine, it is baseline of benchmark."""
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, buffer)
+
+
+ENGINES: Dict[str, Callable[[str, str, int, bool], Optional[object]]] = {
+    "mmcopy": fastcopy.mmcopy,
+    "rwcopy": fastcopy.rwcopy,
+    "copyfileobj": shcopy,
+    "cfrcopy": fastcopy.cfrcopy,
+    "sfcopy": fastcopy.sfcopy,
+    "refcopy": fastcopy.refcopy,
+    "sparsecopy": fastcopy.sparsecopy,
+    "parcopy": fastcopy.parcopy,
+    "directcopy": fastcopy.directcopy,
+    "autocopy": fastcopy.autocopy,
+}
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.blake2b()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(SPARSE_EXTENT), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def gen_file(path: str, size: int, sparse: bool) -> str:
+    """Random file, sparse one has SPARSE_DATA share of data in SPARSE_EXTENT extents. Returns its hash."""
+    with open(path, "wb") as file:
+        file.truncate(size)
+        step = int(SPARSE_EXTENT / SPARSE_DATA) if sparse else SPARSE_EXTENT
+        for offset in range(0, size, step):
+            chunk = os.urandom(min(SPARSE_EXTENT, size - offset))
+            file.seek(offset)
+            file.write(chunk)
+    return file_hash(path)
+
+
+def get_rss_kb(field: str) -> Optional[int]:
+    """`VmRSS` (current) or `VmHWM` (peak) RSS of the process, None if there is no /proc."""
+    try:
+        with open("/proc/self/status") as status:
+            return next(int(line.split()[1]) for line in status if line.startswith(field + ":"))
+    except (OSError, StopIteration):
+        return None
+
+
+def reset_peak_rss() -> None:
+    """Peak RSS is reset to current one, so peak of imports is not taken for peak of copy (Linux 4.0+)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def copy_once(engine: str, src_path: str, dst_path: str, buffer: int, fsync: bool) -> None:
+    """Child process part: source is dropped from page cache, wall time, CPU time and peak RSS growth of copy
+    are printed as JSON, 'skip' if engine is unsupported.
+    """
+    with open(src_path, "rb") as src:
+        fastcopy.advise(src.fileno(), "DONTNEED")
+    reset_peak_rss()
+    rss_kb = get_rss_kb("VmRSS")
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    try:
+        ENGINES[engine](src_path, dst_path, buffer, True)
+    except fastcopy.EngineNotSupported:
+        print("skip")
+        return
+    if fsync:
+        with open(dst_path, "rb+") as dst:
+            os.fsync(dst.fileno())
+    wall = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    print(json.dumps({"wall": wall,
+                      "cpu": after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime,
+                      "max_rss_kb": max((get_rss_kb("VmHWM") or after.ru_maxrss) - (rss_kb or before.ru_maxrss), 0)}))
+
+
+def run(engine: str, src_path: str, dst_path: str, buffer: int, fsync: bool) -> Optional[Dict[str, float]]:
+    """Runs engine once in child process, CPU time and peak RSS are taken by the child for the exact copy."""
+    command = [executable, os.path.abspath(__file__), "--run", engine, src_path, dst_path, str(buffer)]
+    if fsync:
+        command.append("--fsync")
+    proc = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    if proc.returncode:
+        raise RuntimeError(f"`{' '.join(command)}` failed with {proc.returncode}")
+    result = proc.stdout.decode().strip()
+    if result == "skip":
+        return None
+    return json.loads(result)
+
+
+def get_fs_type(path: str) -> Optional[str]:
+    """Type of fs the path is on, None if there is no /proc/mounts."""
+    path = os.path.realpath(path)
+    try:
+        with open("/proc/mounts") as mounts:
+            # mount points with spaces are escaped, they are not expected here
+            points = [(line.split()[1], line.split()[2]) for line in mounts]
+    except OSError:
+        return None
+    # the longest mount point containing the path, the last mounted one wins
+    matched = [(len(point), i, fs_type) for i, (point, fs_type) in enumerate(points)
+               if path == point or path.startswith(os.path.join(point, ""))]
+    return max(matched)[2] if matched else None
+
+
+def bench(engines: List[str], locations: Dict[str, str], sizes: List[int], sparsity: List[bool],
+          buffers: List[int], repeat: int, fsync: bool, verify: bool) -> List[Measure]:
+    measures: List[Measure] = []
+    for location, base_dir in locations.items():
+        with TemporaryDirectory(dir=base_dir, prefix="fastcopy-bench-") as tmpdir:
+            for size in sizes:
+                for sparse in sparsity:
+                    # the first extent is data, so there is no hole in small file
+                    if sparse and size <= SPARSE_EXTENT:
+                        print(f"sparse {size / MB:.0f} MB file has no holes, it is skipped")
+                        continue
+
+                    src_path, dst_path = os.path.join(tmpdir, "src"), os.path.join(tmpdir, "dst")
+                    digest = gen_file(src_path, size, sparse)
+
+                    for engine in engines:
+                        # buffer independent engines are run once
+                        uses_buffer = fastcopy.uses_buffer(ENGINES[engine])
+                        for buffer in buffers if uses_buffer else buffers[:1]:
+                            runs = [run(engine, src_path, dst_path, buffer, fsync) for _ in range(repeat)]
+                            if None in runs:
+                                print(f"{engine:<12} {location:<6} is not supported")
+                                break
+                            if verify and file_hash(dst_path) != digest:
+                                raise RuntimeError(f"{engine} copy differs from source on {location} {size}")
+
+                            best = min(runs, key=lambda r: r["wall"])  # type: ignore
+                            max_rss_kb = int(max(r["max_rss_kb"] for r in runs))  # type: ignore
+                            measures.append(Measure(engine, location, size, sparse, buffer if uses_buffer else 0,
+                                                    best["wall"], best["cpu"], max_rss_kb, size / MB / best["wall"]))
+                            print_measure(measures[-1])
+
+                    os.remove(src_path)
+                    if os.path.exists(dst_path):
+                        os.remove(dst_path)
+
+    return measures
+
+
+def print_measure(measure: Measure) -> None:
+    print(f"{measure.engine:<12} {measure.location:<6} {measure.size / MB:>8.0f} "
+          f"{'yes' if measure.sparse else 'no':<6} {measure.buffer // 1024 or '-':>8} {measure.wall:>8.3f} "
+          f"{measure.cpu:>8.3f} {measure.max_rss_kb / 1024:>8.1f} {measure.throughput:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="""Benchmark of fastcopy engines.
+                                     Each copy is run as separate process on generated dense and sparse files
+                                     on tmpfs and disk, wall time, CPU time and peak RSS growth of copy
+                                     and throughput are measured. Buffer independent engines are run once.
+                                     Unsupported engines (e.g. reflink on ext4, O_DIRECT on tmpfs)
+                                     and sparse files without holes are skipped.""")
+    parser.add_argument("-e", "--engines", default=",".join(ENGINES),
+                        help=f"Comma separated engines: {', '.join(ENGINES)}. Default is all of them")
+    parser.add_argument("-n", "--sizes", default="1,64,256",
+                        help="Comma separated file sizes in MB. Default is 1,64,256")
+    parser.add_argument("-s", "--sparsity", default="dense,sparse",
+                        help="Comma separated kinds of files: dense, sparse. Default is both")
+    parser.add_argument("-b", "--buffers", default=f"65536,{512 * mmap.PAGESIZE},16777216",
+                        help=f"Comma separated buffer sizes. Default is 65536,{512 * mmap.PAGESIZE},16777216")
+    parser.add_argument("--tmpfs", default="/dev/shm",
+                        help="Directory on tmpfs, empty value skips it. Default is /dev/shm")
+    parser.add_argument("--disk", default=gettempdir(),
+                        help=f"Directory on disk, empty value skips it. Default is {gettempdir()}")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Number of runs of each engine, the fastest one is taken. Default is 3")
+    parser.add_argument("--fsync", action="store_true",
+                        help="Include fsync of destination into measured time")
+    parser.add_argument("--no-verify", action="store_true",
+                        help="Do not compare copies with sources")
+    parser.add_argument("-o", "--output",
+                        help="Path to JSON file for results")
+    parser.add_argument("--run", nargs=4, metavar=("ENGINE", "SRC", "DST", "BUFFER"),
+                        help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+
+    if opts.run:
+        engine, src_path, dst_path, buffer = opts.run
+        copy_once(engine, src_path, dst_path, int(buffer), opts.fsync)
+        exit(0)
+
+    locations = {name: path for name, path in (("tmpfs", opts.tmpfs), ("disk", opts.disk)) if path}
+    if "disk" in locations and get_fs_type(locations["disk"]) in MEMORY_FS:
+        print(f"{locations.pop('disk')} is on {get_fs_type(opts.disk)}, not on disk, it is skipped. "
+              "Use --disk for disk-backed directory")
+
+    print(f"{'engine':<12} {'fs':<6} {'size, MB':>8} {'sparse':<6} {'buf, KB':>8} {'wall, s':>8} "
+          f"{'cpu, s':>8} {'RSS+, MB':>8} {'MB/s':>10}")
+    measures = bench(opts.engines.split(","), locations, [int(s) * MB for s in opts.sizes.split(",")],
+                     [s == "sparse" for s in opts.sparsity.split(",")],
+                     [int(b) for b in opts.buffers.split(",")], opts.repeat, opts.fsync, not opts.no_verify)
+
+    if opts.output:
+        with open(opts.output, "w") as file:
+            json.dump([m._asdict() for m in measures], file, indent=2)
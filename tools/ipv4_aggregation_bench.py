@@ -0,0 +1,257 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import subprocess
+import time
+from ipaddress import IPv4Network
+from sys import executable, exit
+from tempfile import TemporaryDirectory
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import ipv4_deduplication_aggregation
+
+
+AGGREGATOR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ipv4_deduplication_aggregation.py")
+# first octets of public unicast space, reserved and multicast ones are skipped
+PUBLIC_OCTETS: List[int] = [o for o in range(1, 224) if o not in (10, 100, 127, 169, 172, 192, 198)]
+# approximate share of prefix lengths in full BGP table
+BGP_PREFIXLENS: Dict[int, float] = {8: 0.0001, 12: 0.001, 13: 0.002, 14: 0.004, 15: 0.007, 16: 0.014,
+                                    17: 0.008, 18: 0.014, 19: 0.025, 20: 0.041, 21: 0.045, 22: 0.121,
+                                    23: 0.104, 24: 0.613}
+# interval of sampling RSS of engine process and its children, e.g. workers of `py-parallel`
+RSS_SAMPLE_INTERVAL: float = 0.01
+
+
+class Measure(NamedTuple):
+    engine: str
+    generator: str
+    size: int
+    wall: float
+    max_rss_kb: int
+    tree_rss_kb: int
+    throughput: float
+    output_hash: str
+
+
+def to_str(network: int, prefixlen: int) -> str:
+    return str(IPv4Network((network & ~(2 ** 32 - 1 >> prefixlen) & 2 ** 32 - 1, prefixlen)))
+
+
+def gen_random(size: int, rnd: random.Random) -> List[str]:
+    return [to_str(rnd.getrandbits(32), rnd.randint(8, 32)) for _ in range(size)]
+
+
+def gen_dense(size: int, rnd: random.Random) -> List[str]:
+    """Runs of adjacent /24s, most of them are merged to larger networks."""
+    nets: List[str] = []
+    while len(nets) < size:
+        start = rnd.choice(PUBLIC_OCTETS) << 24 | rnd.getrandbits(16) << 8
+        nets.extend(to_str(start + (i << 8), 24) for i in range(min(rnd.randint(1, 512), size - len(nets))))
+    return nets
+
+
+def gen_nested(size: int, rnd: random.Random) -> List[str]:
+    """Subnets of few large networks at all depths, most of them are absorbed."""
+    bases = [(rnd.choice(PUBLIC_OCTETS) << 24 | rnd.getrandbits(8) << 16, rnd.randint(12, 16))
+             for _ in range(max(1, size // 1000))]
+    nets: List[str] = []
+    for _ in range(size):
+        network, prefixlen = rnd.choice(bases)
+        sub_prefixlen = rnd.randint(prefixlen, 32)
+        nets.append(to_str(network | rnd.getrandbits(32 - prefixlen), sub_prefixlen))
+    return nets
+
+
+def gen_bgp(size: int, rnd: random.Random) -> List[str]:
+    """Prefix lengths distributed like in full BGP table, more specifics are clustered by /16."""
+    prefixlens = rnd.choices(list(BGP_PREFIXLENS), weights=list(BGP_PREFIXLENS.values()), k=size)
+    clusters = [rnd.choice(PUBLIC_OCTETS) << 24 | rnd.getrandbits(8) << 16 for _ in range(max(1, size // 50))]
+    return [to_str(rnd.choice(clusters) | rnd.getrandbits(16), p) if p >= 16
+            else to_str(rnd.choice(PUBLIC_OCTETS) << 24 | rnd.getrandbits(24), p)
+            for p in prefixlens]
+
+
+GENERATORS: Dict[str, Callable[[int, random.Random], List[str]]] = {
+    "random": gen_random,
+    "dense": gen_dense,
+    "nested": gen_nested,
+    "bgp": gen_bgp,
+}
+
+
+def get_engines(go_binary: Optional[str], jobs: int) -> Dict[str, List[str]]:
+    """Commands of engines, `{filepath}` is replaced by path to input file.
+    `py-numpy` is available if NumPy is installed, `go` if its binary given.
+    """
+    engines = {
+        "py-interval": [executable, AGGREGATOR, "-e", "interval", "-f", "{filepath}"],
+        "py-reduce": [executable, AGGREGATOR, "-e", "reduce", "-f", "{filepath}"],
+        "py-stream": [executable, AGGREGATOR, "--stream", "-f", "{filepath}"],
+        "py-parallel": [executable, AGGREGATOR, "-j", str(jobs), "-f", "{filepath}"],
+    }
+    if "numpy" in ipv4_deduplication_aggregation.ENGINES:
+        engines["py-numpy"] = [executable, AGGREGATOR, "-e", "numpy", "-f", "{filepath}"]
+    if go_binary:
+        engines["go"] = [go_binary, "-filepath", "{filepath}"]
+    return engines
+
+
+def get_tree_rss_kb(pid: int) -> int:
+    """Current RSS of process and all its descendants, 0 if there is no /proc."""
+    total, pids = 0, [pid]
+    while pids:
+        pid = pids.pop()
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                total += next((int(line.split()[1]) for line in status if line.startswith("VmRSS:")), 0)
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as children:
+                    pids.extend(int(child) for child in children.read().split())
+        # process exited during sampling
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+def run(command: List[str], filepath: str) -> Dict[str, object]:
+    """Runs engine once, peak RSS is taken for the exact child process (`max_rss_kb`)
+    and for the whole process tree by sampling it (`tree_rss_kb`), so workers of `py-parallel` are counted too.
+    """
+    command = [c.format(filepath=filepath) for c in command]
+    with TemporaryDirectory() as tmpdir:
+        output, errors = os.path.join(tmpdir, "output"), os.path.join(tmpdir, "errors")
+        with open(output, "wb") as out, open(errors, "wb") as err:
+            start = time.perf_counter()
+            proc = subprocess.Popen(command, stdout=out, stderr=err)
+            tree_rss_kb = 0
+            while True:
+                tree_rss_kb = max(tree_rss_kb, get_tree_rss_kb(proc.pid))
+                pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+                if pid:
+                    break
+                time.sleep(RSS_SAMPLE_INTERVAL)
+            wall = time.perf_counter() - start
+            # the process is waited already, so Popen has to know its exit code
+            proc.returncode = os.waitstatus_to_exitcode(status)
+
+        if proc.returncode:
+            with open(errors) as err:
+                raise RuntimeError(f"`{' '.join(command)}` failed with {proc.returncode}: {err.read().strip()}")
+
+        with open(output, "rb") as out:
+            # lines are compared as set, engines may order equal results differently
+            digest = hashlib.sha256(b"\n".join(sorted(out.read().split()))).hexdigest()
+
+    # sampling may miss short peak of the process itself
+    return {"wall": wall, "max_rss_kb": usage.ru_maxrss, "tree_rss_kb": max(tree_rss_kb, usage.ru_maxrss),
+            "output_hash": digest}
+
+
+def bench(engines: Dict[str, List[str]], generators: List[str], sizes: List[int],
+          repeat: int, seed: int) -> List[Measure]:
+    measures: List[Measure] = []
+    with TemporaryDirectory() as tmpdir:
+        for generator in generators:
+            for size in sizes:
+                filepath = os.path.join(tmpdir, f"{generator}-{size}.txt")
+                with open(filepath, "w") as file:
+                    file.write("\n".join(GENERATORS[generator](size, random.Random(seed))))
+
+                for engine, command in engines.items():
+                    runs = [run(command, filepath) for _ in range(repeat)]
+                    best = min(runs, key=lambda r: r["wall"])
+                    measures.append(Measure(engine, generator, size, best["wall"],  # type: ignore
+                                            max(r["max_rss_kb"] for r in runs),  # type: ignore
+                                            max(r["tree_rss_kb"] for r in runs),  # type: ignore
+                                            size / best["wall"], best["output_hash"]))  # type: ignore
+                    print_measure(measures[-1])
+
+    return measures
+
+
+def print_measure(measure: Measure) -> None:
+    print(f"{measure.engine:<12} {measure.generator:<8} {measure.size:>10} "
+          f"{measure.wall:>10.3f} {measure.max_rss_kb / 1024:>10.1f} {measure.tree_rss_kb / 1024:>10.1f} "
+          f"{measure.throughput:>14.0f}")
+
+
+def check_outputs(measures: List[Measure]) -> List[str]:
+    """All engines have to give the same result for the same input."""
+    errors: List[str] = []
+    results: Dict[tuple, Measure] = {}
+    for m in measures:
+        first = results.setdefault((m.generator, m.size), m)
+        if first.output_hash != m.output_hash:
+            errors.append(f"{m.engine} result differs from {first.engine} one on {m.generator} {m.size}")
+    return errors
+
+
+def check_regressions(measures: List[Measure], baseline: List[Dict], tolerance: float) -> List[str]:
+    """Python engines are compared to baseline by wall time, go and missing baseline entries are skipped."""
+    errors: List[str] = []
+    base = {(b["engine"], b["generator"], b["size"]): b for b in baseline}
+    for m in measures:
+        prev = base.get((m.engine, m.generator, m.size))
+        if not m.engine.startswith("py-") or prev is None:
+            continue
+        if m.wall > prev["wall"] * (1 + tolerance):
+            errors.append(f"{m.engine} regressed on {m.generator} {m.size}: "
+                          f"{m.wall:.3f}s against {prev['wall']:.3f}s of baseline")
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="""Benchmark of networks aggregation engines.
+                                    Each engine is run as separate process on generated inputs,
+                                    wall time, peak RSS of engine process and of its process tree
+                                    and throughput (input lines per second) are measured.
+                                    Exits with 1 if engines results differ or python engine is slower than baseline.""")
+    parser.add_argument("-g", "--generators", default=",".join(GENERATORS),
+                        help=f"Comma separated input generators: {', '.join(GENERATORS)}. Default is all of them")
+    parser.add_argument("-n", "--sizes", default="10000,100000",
+                        help="Comma separated numbers of input lines. Default is 10000,100000")
+    parser.add_argument("-e", "--engines",
+                        help="Comma separated engines to run. Default is all python ones and go if its binary given")
+    parser.add_argument("--go-binary",
+                        help="Path to built ipv4_deduplication_aggregation.go")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Number of processes for `py-parallel` engine. Default is number of CPUs")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Number of runs of each engine, the fastest one is taken. Default is 3")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of input generators. Default is 0")
+    parser.add_argument("-o", "--output",
+                        help="Path to JSON file for results")
+    parser.add_argument("-b", "--baseline",
+                        help="Path to JSON file with results of previous run")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.1,
+                        help="Allowed slowdown against baseline. Default is 0.1 (10%%)")
+    opts = parser.parse_args()
+
+    engines = get_engines(opts.go_binary, opts.jobs)
+    if opts.engines:
+        unknown = [e for e in opts.engines.split(",") if e not in engines]
+        if unknown:
+            parser.error(f"not available engines: {', '.join(unknown)}, available ones: {', '.join(engines)}. "
+                         "py-numpy requires NumPy, go requires --go-binary")
+        engines = {e: engines[e] for e in opts.engines.split(",")}
+
+    print(f"{'engine':<12} {'input':<8} {'lines':>10} {'wall, s':>10} {'RSS, MB':>10} {'tree, MB':>10} "
+          f"{'lines/s':>14}")
+    measures = bench(engines, opts.generators.split(","), [int(s) for s in opts.sizes.split(",")],
+                     opts.repeat, opts.seed)
+
+    if opts.output:
+        with open(opts.output, "w") as file:
+            json.dump([m._asdict() for m in measures], file, indent=2)
+
+    errors = check_outputs(measures)
+    if opts.baseline:
+        with open(opts.baseline) as file:
+            errors.extend(check_regressions(measures, json.load(file), opts.tolerance))
+
+    for error in errors:
+        print(error)
+    exit(1 if errors else 0)
@@ -1,13 +1,66 @@
 import argparse
-from functools import reduce
-from ipaddress import IPv4Network, ip_network
-from sys import exit
-from typing import (Any, Callable, Generic, List, NoReturn, Optional, Tuple,
-                    TypeVar, Union)
+import hashlib
+import heapq
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial, reduce
+from importlib.util import find_spec
+from bisect import bisect_left, bisect_right
+from ipaddress import (IPv4Address, IPv4Network, IPv6Address, IPv6Network,
+                       ip_network)
+from itertools import chain, islice
+from string import hexdigits
+from sys import exit, stderr, stdin, stdout
+from tempfile import NamedTemporaryFile, TemporaryFile
+from typing import (IO, Any, Callable, Dict, Generic, Iterable, Iterator, List,
+                    NamedTuple, NoReturn, Optional, Tuple, TypeVar, Union)
 
 
-Value = TypeVar("Value", List[str], List[IPv4Network])
+class LazyNumPy:
+    """NumPy module imported on first attribute access, import takes ~100 ms and most runs do not use it."""
+
+    def __getattr__(self, name: str) -> Any:
+        global np
+        import numpy
+        np = numpy
+        return getattr(numpy, name)
+
+
+np: Any = LazyNumPy() if find_spec("numpy") is not None else None
+
+
+Network = Union[IPv4Network, IPv6Network]
+Value = TypeVar("Value", List[str], List[Network], Iterator[str])
 Error = TypeVar("Error", str, Exception, contravariant=True)
+Interval = Tuple[int, int]
+Prefix = Tuple[int, int]
+
+IPV4_MAX: int = 2 ** 32 - 1
+IPV6_MAX: int = 2 ** 128 - 1
+# IPv6 addresses are shifted above IPv4 space as integers, so both families are sorted
+# and merged in one pass, but IPv4 and IPv6 intervals are never adjacent
+IPV6_OFFSET: int = 2 ** 128
+UINT64_MAX: int = 2 ** 64 - 1
+STDIN: str = "-"
+# approximate size of interval in memory: list pointer, tuple and two ints
+INTERVAL_SIZE: int = 128
+SPILL_RECORDS: Dict[int, struct.Struct] = {4: struct.Struct(">II"), 6: struct.Struct(">QQQQ")}
+# number of records read from spill file at once
+SPILL_READ_RECORDS: int = 8192
+# max number of spill files merged at once, keeps number of open files under common limits
+SPILL_MERGE_FANIN: int = 256
+# binary format: header with magic, version and number of IPv4 and IPv6 records, then packed IPv4 records
+# of network and prefix length, then IPv6 ones with network split into high and low 64 bits
+BINARY_MAGIC: bytes = b"NETS"
+BINARY_VERSION: int = 2
+BINARY_HEADER = struct.Struct(">4sHQQ")
+BINARY_RECORDS: Dict[int, struct.Struct] = {4: struct.Struct(">IB"), 6: struct.Struct(">QQB")}
+# size of block read from input file for calculation of cache key
+CACHE_READ_SIZE: int = 2 ** 20
+# longest network string handled by vectorized parser, e.g. `255.255.255.255/32`
+NP_PREFIX_WIDTH: int = 18
 
 
 class Result(Generic[Error, Value]):
@@ -34,18 +87,18 @@ class Result(Generic[Error, Value]):
 
 class Success(Result):
     @property
-    def value(self) -> Union[List[str], List[IPv4Network]]:
+    def value(self) -> Union[List[str], List[Network], Iterator[str]]:
         return self._value
 
     def __init__(self, value: Value):
-        self._value: Union[List[str], List[IPv4Network]] = value
+        self._value: Union[List[str], List[Network], Iterator[str]] = value
 
-    def fmap(self, func: Callable[[Union[List[str], List[IPv4Network]]], Any]) -> "Success":
+    def fmap(self, func: Callable[[Union[List[str], List[Network]]], Any]) -> "Success":
         assert callable(func), "fmap argument has to be callable"
 
         return Success(func(self._value))
 
-    def bind(self, func: Callable[[Union[List[str], List[IPv4Network]]], Result[Error, Value]]) -> Result[Error, Value]:
+    def bind(self, func: Callable[[Union[List[str], List[Network]]], Result[Error, Value]]) -> Result[Error, Value]:
         return func(self._value)
 
 
@@ -64,20 +117,31 @@ class Failure(Result):
         return self
 
 
+def check_input_options(string: Optional[str], filepath: Optional[str]) -> Optional[str]:
+    if string is None and filepath is None:
+        return "No input defined. Choose string or file input."
+    if string is not None and filepath is not None:
+        return "Both input options can not be used at the same time."
+    return None
+
+
+def open_input(filepath: str) -> IO[str]:
+    return stdin if filepath == STDIN else open(filepath, "r")
+
+
 def get_nets_from_input(string: Optional[str], filepath: Optional[str]) -> Result[Error, List[str]]:
     source: List[str]
     error: str
 
-    if string is None and filepath is None:
-        return Failure("No input defined. Choose string or file input.")
-    if string is not None and filepath is not None:
-        return Failure("Both input options can not be used at the same time.")
+    options_error = check_input_options(string, filepath)
+    if options_error is not None:
+        return Failure(options_error)
     if string is not None:
         source = string.strip().split(" ")
         error = f"string: `{string}`"
     else:
         try:
-            with open(filepath, "r") as file:  # type: ignore
+            with open_input(filepath) as file:  # type: ignore
                 source = [l.strip() for l in file.readlines()]
                 error = f"file: `{filepath}`"
 
@@ -89,9 +153,10 @@ def get_nets_from_input(string: Optional[str], filepath: Optional[str]) -> Resul
     return Success(lines) if lines else Failure(f"It seems given {error} does not contain a proper data.")
 
 
-def get_net_from_str(nets: List[str]) -> Result[Error, List[IPv4Network]]:
+def get_net_from_str(nets: List[str]) -> Result[Error, List[Network]]:
     try:
-        return Success(sorted(set(ip_network(n) for n in nets)))
+        # networks of different families are not comparable, IPv4 ones go first
+        return Success(sorted(set(ip_network(n) for n in nets), key=lambda n: (n.version, n)))
 
     except ValueError as exc:
         return Failure(exc)
@@ -146,14 +211,804 @@ def aggregate_networks(nets: List[IPv4Network]) -> List[IPv4Network]:
     return source_nets
 
 
-def get_aggregated(nets: List[IPv4Network]) -> List[str]:
-    return [str(n) for n in aggregate_networks(nets)]
+def split_families(nets: List[Network]) -> List[List[Network]]:
+    return [[n for n in nets if n.version == version] for version in (4, 6)]
+
+
+def net_to_prefix(net: Network) -> Prefix:
+    return int(net.network_address) + (IPV6_OFFSET if net.version == 6 else 0), net.prefixlen
+
+
+def prefix_to_net(network: int, prefixlen: int) -> Network:
+    if network >= IPV6_OFFSET:
+        return IPv6Network((network - IPV6_OFFSET, prefixlen))
+    return IPv4Network((network, prefixlen))
+
+
+def prefix_to_interval(network: int, prefixlen: int) -> Interval:
+    if network >= IPV6_OFFSET:
+        return network, network | IPV6_MAX >> prefixlen
+    return network, network | IPV4_MAX >> prefixlen
+
+
+def nets_to_intervals(nets: List[Network]) -> List[Interval]:
+    # hostmask is calculated from prefix length, `broadcast_address` creates new address obj
+    return [(int(n.network_address), int(n.network_address) | IPV4_MAX >> n.prefixlen) if n.version == 4
+            else (int(n.network_address) | IPV6_OFFSET, int(n.network_address) | IPV6_OFFSET | IPV6_MAX >> n.prefixlen)
+            for n in nets]
+
+
+def merge_sorted_intervals(intervals: Iterable[Interval]) -> Iterator[Interval]:
+    """Linear sweep over sorted intervals, overlapping and adjacent intervals are joined."""
+    source = iter(intervals)
+    for start, end in source:
+        break
+    else:
+        return
+
+    for next_start, next_end in source:
+        if next_start > end + 1:
+            yield start, end
+            start, end = next_start, next_end
+        elif next_end > end:
+            end = next_end
+    yield start, end
+
+
+def merge_intervals(intervals: List[Interval]) -> List[Interval]:
+    """Single sort and linear sweep, overlapping and adjacent intervals are joined."""
+    return list(merge_sorted_intervals(sorted(intervals)))
+
+
+def interval_to_prefixes(start: int, end: int) -> Iterator[Prefix]:
+    """Splits interval into the largest aligned blocks, yields (network, prefixlen) pairs."""
+    bits = 128 if start >= IPV6_OFFSET else 32
+    while start <= end:
+        # alignment of start limits block size, 0 is aligned to whole space,
+        # shifted IPv6 0 is aligned to whole IPv6 space already
+        size = start & -start if start else IPV4_MAX + 1
+        while start + size - 1 > end:
+            size >>= 1
+        yield start, bits + 1 - size.bit_length()
+        start += size
+
+
+def intervals_to_prefixes(intervals: Iterable[Interval]) -> Iterator[Prefix]:
+    for start, end in intervals:
+        yield from interval_to_prefixes(start, end)
+
+
+def intervals_to_nets(intervals: List[Interval]) -> List[Network]:
+    return [prefix_to_net(*p) for p in intervals_to_prefixes(intervals)]
+
+
+def prefix_to_str(network: int, prefixlen: int) -> str:
+    if network >= IPV6_OFFSET:
+        return f"{IPv6Address(network - IPV6_OFFSET)}/{prefixlen}"
+    return f"{network >> 24}.{network >> 16 & 255}.{network >> 8 & 255}.{network & 255}/{prefixlen}"
+
+
+def prefixes_to_str(prefixes: Iterable[Prefix]) -> Iterator[str]:
+    """Formats (network, prefixlen) pairs as strings, without creation of network objs."""
+    return (prefix_to_str(*p) for p in prefixes)
+
+
+def intervals_to_str(intervals: List[Interval]) -> List[str]:
+    return list(prefixes_to_str(intervals_to_prefixes(intervals)))
+
+
+def aggregate_intervals(nets: List[Network]) -> List[Network]:
+    """Same result as `aggregate_networks`, nets are handled as (start, end) integer pairs.
+
+    Absorbing and merging of siblings are both covered by joining of overlapping and adjacent intervals,
+    then each joined interval is split back into CIDR prefixes, so result does not depend on number of passes.
+    """
+    if len(nets) < 2:
+        return nets
+
+    return intervals_to_nets(merge_intervals(nets_to_intervals(nets)))
+
+
+def get_prefixes_networks(nets: List[Network]) -> List[Prefix]:
+    return [net_to_prefix(n) for family in split_families(nets) for n in aggregate_networks(family)]
+
+
+def get_prefixes_intervals(nets: List[Network]) -> List[Prefix]:
+    return list(intervals_to_prefixes(merge_intervals(nets_to_intervals(nets))))
+
+
+ENGINES: Dict[str, Callable[[List[Network]], List[Prefix]]] = {
+    "interval": get_prefixes_intervals,
+    "reduce": get_prefixes_networks,
+}
+
+
+def get_aggregated_prefixes(nets: List[Network], engine: str = "interval") -> List[Prefix]:
+    return ENGINES[engine](nets)
+
+
+def get_aggregated(nets: List[Network], engine: str = "interval") -> List[str]:
+    return list(prefixes_to_str(get_aggregated_prefixes(nets, engine)))
+
+
+def get_lines_from_input(string: Optional[str], filepath: Optional[str]) -> Result[Error, Iterator[str]]:
+    """Lazy version of `get_nets_from_input`, lines are neither read at once nor deduplicated."""
+    options_error = check_input_options(string, filepath)
+    if options_error is not None:
+        return Failure(options_error)
+    if string is not None:
+        return Success(l for l in string.strip().split(" ") if l and l.isprintable())
+
+    try:
+        file = open_input(filepath)  # type: ignore
+
+    except (FileNotFoundError, PermissionError) as exc:
+        return Failure(exc)
+
+    def read_lines() -> Iterator[str]:
+        with file:
+            for line in file:
+                line = line.strip()
+                if line and line.isprintable():
+                    yield line
+
+    return Success(read_lines())
+
+
+def parse_interval(net: str) -> Interval:
+    return prefix_to_interval(*net_to_prefix(ip_network(net)))
+
+
+def pack_intervals(intervals: List[Interval], version: int) -> bytes:
+    if version == 4:
+        return b"".join(SPILL_RECORDS[4].pack(*i) for i in intervals)
+    # offset bit is dropped by masking
+    return b"".join(SPILL_RECORDS[6].pack(s >> 64 & UINT64_MAX, s & UINT64_MAX, e >> 64 & UINT64_MAX, e & UINT64_MAX)
+                    for s, e in intervals)
+
+
+def unpack_intervals(block: bytes, version: int) -> Iterator[Interval]:
+    if version == 4:
+        return SPILL_RECORDS[4].iter_unpack(block)
+    return ((IPV6_OFFSET | sh << 64 | sl, IPV6_OFFSET | eh << 64 | el)
+            for sh, sl, eh, el in SPILL_RECORDS[6].iter_unpack(block))
+
+
+def spill_intervals(intervals: Iterable[Interval], version: int, tmpdir: Optional[str]) -> IO[bytes]:
+    spill = TemporaryFile(dir=tmpdir)
+    source = iter(intervals)
+    block = list(islice(source, SPILL_READ_RECORDS))
+    while block:
+        spill.write(pack_intervals(block, version))
+        block = list(islice(source, SPILL_READ_RECORDS))
+    spill.seek(0)
+    return spill
+
+
+def read_spilled(spill: IO[bytes], version: int) -> Iterator[Interval]:
+    size = SPILL_RECORDS[version].size * SPILL_READ_RECORDS
+    with spill:
+        block = spill.read(size)
+        while block:
+            yield from unpack_intervals(block, version)
+            block = spill.read(size)
+
+
+def merge_spills(spills: List[IO[bytes]], version: int) -> Iterator[Interval]:
+    return merge_sorted_intervals(heapq.merge(*(read_spilled(s, version) for s in spills)))
+
+
+def sort_intervals_external(lines: Iterable[str], memory_budget: int, tmpdir: Optional[str] = None) -> Iterator[Interval]:
+    """Parses lines and returns merged intervals in order, keeping at most `memory_budget` bytes of intervals.
+
+    Intervals are collected until budget is reached, then sorted, merged and spilled to temporary file.
+    Spills are merged back lazily, though all lines are parsed before the first interval is returned,
+    so parsing errors are raised by this function, not by the returned iterator.
+    """
+    chunk_size: int = max(1, memory_budget // INTERVAL_SIZE)
+    chunk: List[Interval] = []
+    # spills are kept per family, IPv4 records are 4 times smaller
+    spills: Dict[int, List[IO[bytes]]] = {4: [], 6: []}
+
+    def spill_chunk() -> None:
+        merged = merge_intervals(chunk)
+        border = bisect_left(merged, (IPV6_OFFSET, 0))
+        for version, part in ((4, merged[:border]), (6, merged[border:])):
+            if not part:
+                continue
+
+            spills[version].append(spill_intervals(part, version, tmpdir))
+            # merging spills to one, so only limited number of files is open at the same time
+            if len(spills[version]) == SPILL_MERGE_FANIN:
+                spills[version] = [spill_intervals(merge_spills(spills[version], version), version, tmpdir)]
+
+    try:
+        for line in lines:
+            chunk.append(parse_interval(line))
+            if len(chunk) < chunk_size:
+                continue
+
+            spill_chunk()
+            chunk = []
+
+        if chunk and (spills[4] or spills[6]):
+            spill_chunk()
+            chunk = []
+
+    except BaseException:
+        for spill in chain(spills[4], spills[6]):
+            spill.close()
+        raise
+
+    if not chunk:
+        return chain(merge_spills(spills[4], 4), merge_spills(spills[6], 6))
+
+    return iter(merge_intervals(chunk))
+
+
+def get_stream_prefixes(lines: Iterable[str], memory_budget: int, tmpdir: Optional[str] = None) -> Result[Error, Iterator[Prefix]]:
+    try:
+        intervals = sort_intervals_external(lines, memory_budget, tmpdir)
+
+    except (ValueError, OSError) as exc:
+        return Failure(exc)
+
+    first = next(intervals, None)
+    if first is None:
+        return Failure("It seems given input does not contain a proper data.")
+
+    return Success(intervals_to_prefixes(chain((first,), intervals)))
+
+
+def get_shard(net: str) -> int:
+    # IPv6 ones are after all IPv4 ones, IPv4-mapped addresses contain dots too
+    if ":" in net:
+        hextet = net.partition(":")[0] or "0"
+        return 256 + int(hextet, 16) if len(hextet) <= 4 and all(c in hexdigits for c in hextet) else -1
+
+    octet = net.partition(".")[0]
+    return int(octet) if octet.isdecimal() else -1
+
+
+def shard_nets(nets: List[str]) -> List[List[str]]:
+    """Groups nets by first octet, that is by /8 they start in, IPv6 nets are grouped by first hextet, that is by /16.
+    Shards are ordered by address.
+
+    Octet is taken from string as is, improper strings get to some shard and are reported on parsing.
+    """
+    shards: Dict[int, List[str]] = {}
+    for net in nets:
+        shards.setdefault(get_shard(net), []).append(net)
+
+    return [shards[k] for k in sorted(shards)]
+
+
+def aggregate_shard(nets: List[str]) -> List[Interval]:
+    return merge_intervals([parse_interval(n) for n in nets])
+
+
+def get_prefixes_parallel(nets: List[str], jobs: Optional[int] = None) -> Result[Error, List[Prefix]]:
+    """Replaces `get_net_from_str` and `get_aggregated_prefixes` steps, each shard is parsed and aggregated
+    in separate process.
+
+    Intervals of shard start inside of its range but may end after it, so results of shards are ordered by address
+    and joined with one more linear sweep, which also merges intervals adjacent over shard boundaries.
+    """
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            shards = list(executor.map(aggregate_shard, shard_nets(nets)))
+
+    except ValueError as exc:
+        return Failure(exc)
+
+    return Success(list(intervals_to_prefixes(merge_sorted_intervals(chain.from_iterable(shards)))))
+
+
+def parse_prefix_np(net: str) -> Tuple[int, int]:
+    parsed = ip_network(net)
+    if parsed.version != 4:
+        raise ValueError(f"{net} is not IPv4 network")
+    return int(parsed.network_address), parsed.prefixlen
+
+
+def parse_prefixes_np(nets: List[str]) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Bulk parsing of `a.b.c.d[/len]` strings into uint32 networks and uint8 prefix lengths.
+
+    Strings are handled as matrix of characters column by column, so each step is done for all strings at once.
+    Strings which are not in plain form (netmask instead of length, leading zeros, host bits set, etc.)
+    are parsed by `ip_network`, so the same networks are accepted and the same errors are raised.
+    """
+    count = len(nets)
+    width = NP_PREFIX_WIDTH + 1
+    # extra column guarantees zero terminator for each string
+    chars = np.zeros((count, width), dtype=np.uint32)
+    chars[:, :NP_PREFIX_WIDTH] = np.array(nets, dtype=f"U{NP_PREFIX_WIDTH}").view(np.uint32).reshape(count, NP_PREFIX_WIDTH)
+
+    fields = np.zeros((count, 5), dtype=np.int64)
+    current = np.zeros(count, dtype=np.int64)
+    digits = np.zeros(count, dtype=np.int64)
+    field = np.zeros(count, dtype=np.int64)
+    done = np.zeros(count, dtype=bool)
+    bad = np.fromiter(map(len, nets), dtype=np.int64, count=count) > NP_PREFIX_WIDTH
+
+    for column in chars.T:
+        active = ~done
+        digit = active & (column >= 48) & (column <= 57)
+        dot = active & (column == 46)
+        slash = active & (column == 47)
+        end = active & (column == 0)
+        separator = dot | slash | end
+
+        bad |= active & ~(digit | separator)
+        # leading zeros
+        bad |= digit & (digits > 0) & (current == 0)
+        current = np.where(digit, current * 10 + column - 48, current)
+        digits += digit
+
+        bad |= separator & ((digits == 0) | (digits > 3))
+        bad |= dot & (field >= 3) | slash & (field != 3) | end & (field < 3)
+        rows = np.flatnonzero(separator & ~bad)
+        fields[rows, field[rows]] = current[rows]
+
+        field += separator & ~bad
+        current[separator] = 0
+        digits[separator] = 0
+        done |= end
+
+    octets = fields[:, :4]
+    prefixlen = np.where(field == 5, fields[:, 4], 32)
+    bad |= (octets > 255).any(axis=1) | (prefixlen > 32)
+    prefixlen[bad] = 32
+
+    network = (octets[:, 0] << 24 | octets[:, 1] << 16 | octets[:, 2] << 8 | octets[:, 3])
+    bad |= (network & (IPV4_MAX >> prefixlen)) != 0
+
+    for row in np.flatnonzero(bad):
+        network[row], prefixlen[row] = parse_prefix_np(nets[row])
 
+    return network.astype(np.uint32), prefixlen.astype(np.uint8)
 
-def print_result(nets: Result[Error, List[str]]) -> Union[None, NoReturn]:
+
+def large_absorb_small_np(network: "np.ndarray", prefixlen: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+    """Vectorized `large_absorb_small`, returns sorted networks which are not subnets of other ones."""
+    start = network.astype(np.int64)
+    end = start | IPV4_MAX >> prefixlen.astype(np.int64)
+    # the largest network goes first among the ones with the same address
+    order = np.lexsort((prefixlen, start))
+    start, end, prefixlen = start[order], end[order], prefixlen[order]
+
+    # network is absorbed if it ends before the end of any previous one
+    covered = np.empty(len(end), dtype=np.int64)
+    covered[:1] = -1
+    np.maximum.accumulate(end[:-1], out=covered[1:])
+    keep = end > covered
+
+    return start[keep], prefixlen[keep]
+
+
+def small_merge_large_np(network: "np.ndarray", prefixlen: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+    """Vectorized `small_merge_large`, sorted disjoint networks are merged until no siblings are left.
+
+    Network pairs do not intersect, because the first network of pair has to be the lower sibling,
+    the second one has to be the upper sibling, so all pairs are merged at once on each pass.
+    """
+    prefixlen = prefixlen.astype(np.int64)
+
+    while len(network) > 1:
+        size = np.int64(1) << (32 - prefixlen[:-1])
+        siblings = ((prefixlen[:-1] == prefixlen[1:]) & (prefixlen[:-1] > 0)
+                    & (network[:-1] & size == 0) & (network[:-1] + size == network[1:]))
+        if not siblings.any():
+            break
+
+        lower = np.flatnonzero(siblings)
+        prefixlen[lower] -= 1
+        keep = np.ones(len(network), dtype=bool)
+        keep[lower + 1] = False
+        network, prefixlen = network[keep], prefixlen[keep]
+
+    return network, prefixlen
+
+
+def aggregate_np(network: "np.ndarray", prefixlen: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+    return small_merge_large_np(*large_absorb_small_np(network, prefixlen))
+
+
+def arrays_to_prefixes(network: "np.ndarray", prefixlen: "np.ndarray") -> List[Prefix]:
+    return list(zip(network.tolist(), prefixlen.tolist()))
+
+
+def get_prefixes_np(nets: List[Network]) -> List[Prefix]:
+    """IPv4 networks are aggregated as arrays, IPv6 ones do not fit uint32 and are aggregated as intervals."""
+    nets4, nets6 = split_families(nets)
+    network = np.fromiter((int(n.network_address) for n in nets4), dtype=np.uint32, count=len(nets4))
+    prefixlen = np.fromiter((n.prefixlen for n in nets4), dtype=np.uint8, count=len(nets4))
+    return arrays_to_prefixes(*aggregate_np(network, prefixlen)) + get_prefixes_intervals(nets6)
+
+
+def get_prefixes_from_str_np(nets: List[str]) -> Result[Error, List[Prefix]]:
+    """Replaces `get_net_from_str` and `get_aggregated_prefixes` steps, IPv4 networks are parsed in bulk."""
+    nets4 = [n for n in nets if ":" not in n]
+    nets6 = [n for n in nets if ":" in n]
+    try:
+        return Success(arrays_to_prefixes(*aggregate_np(*parse_prefixes_np(nets4)))
+                       + list(intervals_to_prefixes(merge_intervals([parse_interval(n) for n in nets6]))))
+
+    except ValueError as exc:
+        return Failure(exc)
+
+
+if np is not None:
+    ENGINES["numpy"] = get_prefixes_np
+
+
+class Delta(NamedTuple):
+    added: List[Network]
+    withdrawn: List[Network]
+
+
+class TrieNode:
+    __slots__ = ("children", "present", "full")
+
+    def __init__(self) -> None:
+        self.children: List[Optional["TrieNode"]] = [None, None]
+        # network was inserted as is
+        self.present: bool = False
+        # the whole network is covered by inserted ones
+        self.full: bool = False
+
+
+class IncrementalAggregator:
+    """Keeps aggregated networks up to date on insertion and deletion of single networks.
+
+    Networks are kept in binary trie per family, node is full if its network is inserted or both its children are full.
+    Aggregated networks are the full nodes which have no full parents, that is the same result
+    `aggregate_networks` gives. Update walks only the path to given network, then result changes are
+    collected under the highest node which full state is changed, so only added and withdrawn
+    aggregated networks are returned.
+    """
+
+    def __init__(self, nets: Iterable[Network] = ()) -> None:
+        self._roots: Dict[int, TrieNode] = {4: TrieNode(), 6: TrieNode()}
+        for net in nets:
+            self.insert(net)
+
+    def _path(self, net: Network, create: bool) -> List[TrieNode]:
+        network, bits, node = int(net.network_address), net.max_prefixlen, self._roots[net.version]
+        path = [node]
+        for depth in range(net.prefixlen):
+            bit = network >> (bits - 1 - depth) & 1
+            child = node.children[bit]
+            if child is None:
+                if not create:
+                    return []
+                child = node.children[bit] = TrieNode()
+            node = child
+            path.append(node)
+
+        return path
+
+    def _collect(self, node: TrieNode, network: int, prefixlen: int, bits: int) -> Iterator[Prefix]:
+        if node.full:
+            yield network, prefixlen
+            return
+
+        for bit, child in enumerate(node.children):
+            if child is not None:
+                yield from self._collect(child, network | bit << (bits - 1 - prefixlen), prefixlen + 1, bits)
+
+    def _update(self, net: Network, path: List[TrieNode], present: bool) -> Delta:
+        network, _ = net_to_prefix(net)
+        bits = net.max_prefixlen
+        node = path[-1]
+        if node.present is present:
+            return Delta([], [])
+
+        # full states are calculated upward without changing nodes, so previous result is still available
+        full: List[bool] = [present or all(c is not None and c.full for c in node.children)]
+        for parent, child in zip(reversed(path[:-1]), reversed(path[1:])):
+            sibling = parent.children[parent.children[0] is child]
+            full.append(parent.present or (full[-1] and sibling is not None and sibling.full))
+        full.reverse()
+
+        top = next((d for d, (n, f) in enumerate(zip(path, full)) if n.full is not f), None)
+        # change is not visible if some upper network is full already
+        covered = top is None or any(n.full for n in path[:top])
+        if not covered:
+            top_network = network & ~((2 ** bits - 1) >> top)
+            before = list(self._collect(path[top], top_network, top, bits))
+
+        node.present = present
+        for n, f in zip(path, full):
+            n.full = f
+
+        if not present:
+            self._prune(net, path)
+        if covered:
+            return Delta([], [])
+
+        # full state of top node is changed, so it is on one side and its subnets are on the other one
+        after = self._collect(path[top], top_network, top, bits)
+        return Delta([prefix_to_net(*p) for p in after], [prefix_to_net(*p) for p in before])
+
+    def _prune(self, net: Network, path: List[TrieNode]) -> None:
+        network, bits = int(net.network_address), net.max_prefixlen
+        for depth in range(len(path) - 1, 0, -1):
+            node = path[depth]
+            if node.present or any(node.children):
+                break
+            path[depth - 1].children[network >> (bits - depth) & 1] = None
+
+    def insert(self, net: Network) -> Delta:
+        return self._update(net, self._path(net, create=True), present=True)
+
+    def delete(self, net: Network) -> Delta:
+        path = self._path(net, create=False)
+        return self._update(net, path, present=False) if path else Delta([], [])
+
+    def aggregated(self) -> List[Network]:
+        return [prefix_to_net(*p)
+                for network, bits, root in ((0, 32, self._roots[4]), (IPV6_OFFSET, 128, self._roots[6]))
+                for p in self._collect(root, network, 0, bits)]
+
+
+class LookupIndex:
+    """Index answers whether address or network is covered by aggregated networks.
+
+    Aggregated networks are kept as sorted start and end arrays of joined intervals,
+    so single check is binary search. IPv4 intervals are kept as NumPy arrays too if it is installed,
+    so many IPv4 addresses are checked at once by `covers_np`.
+    """
+
+    def __init__(self, prefixes: Iterable[Prefix]) -> None:
+        intervals = list(merge_sorted_intervals(sorted(prefix_to_interval(*p) for p in prefixes)))
+        self._starts: List[int] = [s for s, _ in intervals]
+        self._ends: List[int] = [e for _, e in intervals]
+
+        if np is not None:
+            border = bisect_left(self._starts, IPV6_OFFSET)
+            self._starts_np = np.array(self._starts[:border], dtype=np.int64)
+            self._ends_np = np.array(self._ends[:border], dtype=np.int64)
+
+    @classmethod
+    def from_nets(cls, nets: Iterable[Network]) -> "LookupIndex":
+        return cls(net_to_prefix(n) for n in nets)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def covers(self, start: int, end: int) -> bool:
+        index = bisect_right(self._starts, start) - 1
+        return index >= 0 and end <= self._ends[index]
+
+    def __contains__(self, item: Union[str, int, IPv4Address, IPv6Address, Network]) -> bool:
+        """Item is address or network as string or obj, integer is IPv4 address or shifted IPv6 one."""
+        if isinstance(item, int):
+            return self.covers(item, item)
+
+        return self.covers(*prefix_to_interval(*net_to_prefix(ip_network(item))))
+
+    def covers_np(self, network: "np.ndarray", prefixlen: Optional["np.ndarray"] = None) -> "np.ndarray":
+        """Vectorized `covers` for IPv4 networks, they are addresses if no prefix lengths given."""
+        network = np.asarray(network, dtype=np.int64)
+        if not len(self._starts_np):
+            return np.zeros(network.shape, dtype=bool)
+
+        end = network if prefixlen is None else network | IPV4_MAX >> np.asarray(prefixlen, dtype=np.int64)
+        index = np.searchsorted(self._starts_np, network, side="right") - 1
+        return (index >= 0) & (end <= self._ends_np[np.maximum(index, 0)])
+
+
+def get_matched(index: LookupIndex, filepath: str) -> Result[Error, List[str]]:
+    """Returns lines of file with addresses or networks which are covered by index, in the given order."""
+    try:
+        with open_input(filepath) as file:
+            lines = [l for l in (l.strip() for l in file) if l and l.isprintable()]
+
+    except (FileNotFoundError, PermissionError) as exc:
+        return Failure(exc)
+
+    try:
+        if np is None:
+            return Success([l for l in lines if l in index])
+
+        # IPv4 ones are parsed and checked in bulk
+        covered = [":" in l and l in index for l in lines]
+        rows4 = np.array([i for i, l in enumerate(lines) if ":" not in l], dtype=np.int64)
+        for row in rows4[index.covers_np(*parse_prefixes_np([lines[i] for i in rows4]))].tolist():
+            covered[row] = True
+
+    except ValueError as exc:
+        return Failure(exc)
+
+    return Success([l for l, c in zip(lines, covered) if c])
+
+
+def pack_prefixes(prefixes: List[Prefix]) -> bytes:
+    return b"".join(BINARY_RECORDS[6].pack(n >> 64 & UINT64_MAX, n & UINT64_MAX, p) if n >= IPV6_OFFSET
+                    else BINARY_RECORDS[4].pack(n, p)
+                    for n, p in prefixes)
+
+
+def write_binary(prefixes: Iterable[Prefix], file: IO[bytes]) -> int:
+    """Writes header and packed (network, prefixlen) records, returns number of records.
+
+    Prefixes have to be ordered as aggregation returns them, so IPv4 records go before IPv6 ones.
+    Number of records is written to header after records if file is seekable,
+    otherwise all prefixes are collected before writing.
+    """
+    seekable = file.seekable()
+    count, count6 = 0, 0
+    if not seekable:
+        prefixes = list(prefixes)
+        count = len(prefixes)  # type: ignore
+        count6 = count - bisect_left(prefixes, (IPV6_OFFSET, 0))  # type: ignore
+    start = file.tell() if seekable else 0
+    file.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, count - count6, count6))
+
+    if not seekable:
+        file.write(pack_prefixes(prefixes))  # type: ignore
+        return count
+
+    source = iter(prefixes)
+    block = list(islice(source, SPILL_READ_RECORDS))
+    while block:
+        file.write(pack_prefixes(block))
+        count += len(block)
+        count6 += sum(n >= IPV6_OFFSET for n, _ in block)
+        block = list(islice(source, SPILL_READ_RECORDS))
+
+    end = file.tell()
+    file.seek(start)
+    file.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, count - count6, count6))
+    file.seek(end)
+
+    return count
+
+
+def read_binary_header(file: IO[bytes]) -> Tuple[int, int]:
+    header = file.read(BINARY_HEADER.size)
+    if len(header) != BINARY_HEADER.size:
+        raise ValueError("Binary data is too short")
+
+    magic, version, count4, count6 = BINARY_HEADER.unpack(header)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError(f"Unknown binary format: `{magic!r}` version {version}")
+
+    return count4, count6
+
+
+def read_binary(file: IO[bytes]) -> List[Prefix]:
+    count4, count6 = read_binary_header(file)
+    data4 = file.read(count4 * BINARY_RECORDS[4].size)
+    data6 = file.read(count6 * BINARY_RECORDS[6].size)
+    if len(data4) != count4 * BINARY_RECORDS[4].size or len(data6) != count6 * BINARY_RECORDS[6].size:
+        raise ValueError(f"Binary data is truncated, {count4} IPv4 and {count6} IPv6 records expected")
+
+    prefixes: List[Prefix] = list(BINARY_RECORDS[4].iter_unpack(data4))
+    prefixes.extend((IPV6_OFFSET | high << 64 | low, p) for high, low, p in BINARY_RECORDS[6].iter_unpack(data6))
+    return prefixes
+
+
+def iter_binary_file(filepath: str) -> Iterator[Prefix]:
+    """Checks header and size of binary file, returns iterator reading its records by blocks."""
+    file = open(filepath, "rb")
+    try:
+        count4, count6 = read_binary_header(file)
+        if os.fstat(file.fileno()).st_size < (BINARY_HEADER.size + count4 * BINARY_RECORDS[4].size
+                                              + count6 * BINARY_RECORDS[6].size):
+            raise ValueError(f"Binary data is truncated, {count4} IPv4 and {count6} IPv6 records expected")
+    except BaseException:
+        file.close()
+        raise
+
+    return read_binary_records(file, count4, count6)
+
+
+def read_binary_records(file: IO[bytes], count4: int, count6: int) -> Iterator[Prefix]:
+    with file:
+        for version, count in ((4, count4), (6, count6)):
+            record = BINARY_RECORDS[version]
+            while count:
+                block = file.read(record.size * min(count, SPILL_READ_RECORDS))
+                if len(block) % record.size or not block:
+                    raise ValueError(f"Binary data is truncated, {count} IPv{version} records are missing")
+                count -= len(block) // record.size
+                if version == 4:
+                    yield from record.iter_unpack(block)
+                else:
+                    yield from ((IPV6_OFFSET | high << 64 | low, p) for high, low, p in record.iter_unpack(block))
+
+
+def load_binary_np(filepath: str) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Maps records of binary file to structured arrays, IPv4 one has `network` and `prefixlen` fields,
+    IPv6 one has `network_high`, `network_low` and `prefixlen` fields.
+    """
+    with open(filepath, "rb") as file:
+        count4, count6 = read_binary_header(file)
+
+    offset4 = BINARY_HEADER.size
+    offset6 = offset4 + count4 * BINARY_RECORDS[4].size
+    dtype4 = np.dtype([("network", ">u4"), ("prefixlen", "u1")])
+    dtype6 = np.dtype([("network_high", ">u8"), ("network_low", ">u8"), ("prefixlen", "u1")])
+
+    # empty array can not be mapped
+    return (np.memmap(filepath, dtype=dtype4, mode="r", offset=offset4, shape=(count4,)) if count4 else np.empty(0, dtype4),
+            np.memmap(filepath, dtype=dtype6, mode="r", offset=offset6, shape=(count6,)) if count6 else np.empty(0, dtype6))
+
+
+def get_cache_path(filepath: str, cache_dir: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, "rb") as file:
+        for block in iter(partial(file.read, CACHE_READ_SIZE), b""):
+            digest.update(block)
+
+    return os.path.join(cache_dir, f"{digest.hexdigest()}-{BINARY_VERSION}.bin")
+
+
+def write_cache(cache_path: str, prefixes: Iterable[Prefix]) -> None:
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # concurrent runs have to see either whole cache file or nothing
+    with NamedTemporaryFile(dir=cache_dir, delete=False) as file:
+        try:
+            write_binary(prefixes, file)
+        except BaseException:
+            os.remove(file.name)
+            raise
+    os.replace(file.name, cache_path)
+
+
+def get_cached_prefixes(filepath: Optional[str], cache_dir: str,
+                        get_prefixes: Callable[[], Result[Error, Iterable[Prefix]]]) -> Result[Error, Iterable[Prefix]]:
+    """Returns aggregated prefixes of file from cache keyed by hash of file content,
+    calls `get_prefixes` and caches its result if there is no cached one.
+
+    Result is written to cache as it is produced and read back by blocks,
+    so `--stream` mode keeps its memory bound with caching too.
+    """
+    try:
+        cache_path = get_cache_path(filepath, cache_dir)  # type: ignore
+
+    # no file or not a file input at all, errors are reported by `get_prefixes`
+    except (TypeError, OSError):
+        return get_prefixes()  # type: ignore
+
+    try:
+        return Success(iter_binary_file(cache_path))
+
+    except (OSError, ValueError):
+        pass
+
+    result = get_prefixes()
+    if result.is_failure():
+        return result
+
+    try:
+        write_cache(cache_path, result.value)
+        return Success(iter_binary_file(cache_path))
+
+    # result is consumed by failed writing, so it is produced again
+    except (OSError, ValueError) as exc:
+        print(f"Can not write cache: {exc}", file=stderr)
+        return get_prefixes()
+
+
+def write_binary_result(prefixes: Result[Error, Iterable[Prefix]], output: Optional[str] = None) -> Union[None, NoReturn]:
+    if prefixes.is_success():
+        with open(output, "wb") if output else nullcontext(stdout.buffer) as file:
+            write_binary(prefixes.value, file)
+    else:
+        print(prefixes.error)
+        exit(1)
+    return None
+
+
+def print_result(nets: Result[Error, Iterable[str]], output: Optional[str] = None) -> Union[None, NoReturn]:
     if nets.is_success():
-        for n in nets.value:
-            print(n)
+        with open(output, "w") if output else nullcontext(stdout) as file:
+            for n in nets.value:
+                print(n, file=file)
     else:
         print(nets.error)
         exit(1)
@@ -161,8 +1016,9 @@ def print_result(nets: Result[Error, List[str]]) -> Union[None, NoReturn]:
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="""IPv4 networks aggregation.
-                                    App aggregates IPv4 networks from given string or file with following mechanic:
+    parser = argparse.ArgumentParser(description="""IPv4 and IPv6 networks aggregation.
+                                    App aggregates IPv4 and IPv6 networks from given string or file with following mechanic,
+                                    each family is aggregated separately, IPv4 networks are followed by IPv6 ones:
                                     1. largest prefix absorbs all its subnet prefixes,
                                       e.g. 10.0.0.0/16 absorbs 10.0.0.0/22, 10.10.0.0/24 and so on;
                                     2. prefixes of the same length merged to their supernet, which prefix is one less,
@@ -173,10 +1029,61 @@ if __name__ == "__main__":
     parser.add_argument("-s", "--string",
                         help="Quoted string of networks separated by space")
     parser.add_argument("-f", "--filepath",
-                        help="Path to file which contains networks separated by new line")
+                        help="Path to file which contains networks separated by new line, `-` is for stdin")
+    parser.add_argument("-e", "--engine", choices=sorted(ENGINES), default="interval",
+                        help="Aggregation engine: `interval` sorts and merges integer ranges once, "
+                             "`reduce` repeats merging passes over networks, "
+                             "`numpy` parses and aggregates IPv4 networks as arrays if NumPy is installed. "
+                             "All of them give the same result. Default is `interval`")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of processes, each one aggregates IPv4 networks of one /8 "
+                             "or IPv6 networks of one /16 at a time "
+                             "with `interval` engine. 0 is for number of CPUs. Default is 1, no extra processes")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read and parse input lazily, sorting it externally with temporary files "
+                             "if it exceeds memory budget. Always uses `interval` engine")
+    parser.add_argument("-m", "--memory-budget", type=int, default=512,
+                        help="Memory budget for parsed input in MB for `--stream` mode. Default is 512")
+    parser.add_argument("--tmpdir",
+                        help="Directory for temporary files of `--stream` mode. Default is system one")
+    parser.add_argument("-F", "--format", choices=["text", "binary"], default="text",
+                        help="Output format: `text` is network per line, `binary` is header and packed records "
+                             "of uint32 IPv4 network and uint8 prefix length followed by records of two uint64 halves "
+                             "of IPv6 network and uint8 prefix length, all in network byte order. Default is `text`")
+    parser.add_argument("-o", "--output",
+                        help="Path to output file. Default is stdout")
+    parser.add_argument("--match",
+                        help="Path to file with addresses or networks separated by new line, `-` is for stdin. "
+                             "Ones covered by aggregated networks are printed instead of aggregated networks")
+    parser.add_argument("--cache-dir",
+                        help="Directory for cached results of file input, keyed by hash of file content. "
+                             "Default is no caching")
     opts = parser.parse_args()
 
-    result = get_nets_from_input(opts.string, opts.filepath
-                                ).bind(get_net_from_str
-                                ).fmap(get_aggregated)
-    print_result(result)
+    def get_prefixes() -> Result[Error, Iterable[Prefix]]:
+        if opts.stream:
+            return get_lines_from_input(opts.string, opts.filepath
+                                       ).bind(partial(get_stream_prefixes,
+                                                      memory_budget=opts.memory_budget * 2 ** 20,
+                                                      tmpdir=opts.tmpdir))
+        if opts.jobs != 1:
+            return get_nets_from_input(opts.string, opts.filepath
+                                      ).bind(partial(get_prefixes_parallel, jobs=opts.jobs or None))
+        if opts.engine == "numpy":
+            return get_nets_from_input(opts.string, opts.filepath
+                                      ).bind(get_prefixes_from_str_np)
+        return get_nets_from_input(opts.string, opts.filepath
+                                  ).bind(get_net_from_str
+                                  ).fmap(partial(get_aggregated_prefixes, engine=opts.engine))
+
+    if opts.cache_dir and opts.string is None and opts.filepath != STDIN:
+        result = get_cached_prefixes(opts.filepath, opts.cache_dir, get_prefixes)
+    else:
+        result = get_prefixes()
+
+    if opts.match:
+        print_result(result.fmap(LookupIndex).bind(partial(get_matched, filepath=opts.match)), opts.output)
+    elif opts.format == "binary":
+        write_binary_result(result, opts.output)
+    else:
+        print_result(result.fmap(prefixes_to_str), opts.output)